@@ -1,20 +1,17 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from reagent_optimizer import ReagentOptimizer
+from reagent_optimizer import OptimizationCache, ReagentOptimizer, TrayGeometry
+from kcf_sheets import KCFMirror, ShipmentSpool, get_kcf_sheet
+from labels import batch_labels, generate_tray_serials, label_sheet
 from datetime import datetime
 from collections import defaultdict
 import importlib
-import gspread
+import hashlib
 import json
-from google.oauth2 import service_account
 from google.oauth2.service_account import Credentials
 import os
 from google.auth.exceptions import GoogleAuthError
-import qrcode
-import io
-import base64
-import uuid
 
 # Set page config
 st.set_page_config(
@@ -123,120 +120,207 @@ def check_required_modules():
             missing_modules.append(module)
     return missing_modules
 
-# Function to initialize Google Sheets connection
+# Sheets access goes through one pooled client per process (see kcf_sheets)
+def get_sheets_creds():
+    try:
+        creds_dict = st.secrets.get("GOOGLE_SHEETS_CREDS", None)
+    except Exception:
+        creds_dict = None
+    return dict(creds_dict) if creds_dict else None
+
+def init_google_sheets():
+    """Shared KCF worksheet, or None when no credentials are configured"""
+    sheet = get_kcf_sheet(get_sheets_creds())
+    if sheet is None:
+        st.error("Google Sheets credentials not found in Streamlit secrets.")
+    return sheet
+
+@st.cache_resource
+def get_optimization_cache():
+    """Share one optimization cache across sessions; set OPTIMIZER_CACHE_PATH to keep it on disk"""
+    return OptimizationCache(path=os.environ.get("OPTIMIZER_CACHE_PATH"))
+
+@st.cache_resource
+def get_optimizer():
+    """One optimizer per process, shared by every session and rerun
+
+    Its portfolio worker processes start on the first portfolio solve and
+    are reused by later ones.
+    """
+    return ReagentOptimizer(cache=get_optimization_cache(), instrument=True)
+
+@st.cache_data
+def get_experiment_groups():
+    """Available experiments grouped into the sidebar tabs"""
+    experiments = get_optimizer().get_available_experiments()
+    return {
+        "LR": [exp for exp in experiments if "(LR)" in exp["name"]],
+        "HR": [exp for exp in experiments if "(HR)" in exp["name"]],
+        "Other": [exp for exp in experiments if "(LR)" not in exp["name"] and "(HR)" not in exp["name"]]
+    }
 
+# Cached solvers take hashable inputs: experiments as a tuple and daily counts as sorted (exp, count) pairs
 
+@st.cache_data(max_entries=256, show_spinner=False)
+def solve_order(experiments, daily_count_items, deadline_ms, use_portfolio):
+    optimizer = get_optimizer()
+    if use_portfolio:
+        return optimizer.optimize_portfolio(list(experiments), dict(daily_count_items), deadline_ms=deadline_ms)
+    return optimizer.optimize_tray_configuration(
+        list(experiments), dict(daily_count_items), deadline_ms=deadline_ms
+    )
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def plan_order(experiments, daily_count_items, num_trays):
+    return get_optimizer().plan_trays(list(experiments), dict(daily_count_items), num_trays=num_trays)
 
-def init_google_sheets():
+@st.cache_data(max_entries=64, show_spinner=False)
+def sweep_daily_counts(experiments, grid_items):
+    return get_optimizer().sweep(list(experiments), {exp: list(values) for exp, values in grid_items})
+
+def config_fingerprint(config):
+    """Stable digest of a tray layout, used to key cached figures"""
+    return hashlib.sha256(json.dumps(config["tray_locations"], sort_keys=True).encode()).hexdigest()
+
+def layout_code(optimizer, config):
+    """base45 layout code for a tray label, or None if the layout cannot be encoded"""
     try:
-        # Get the Google Sheets credentials from the Streamlit secrets
-        creds_dict = st.secrets.get("GOOGLE_SHEETS_CREDS", None)
-        
-        if not creds_dict:
-            st.error("Google Sheets credentials not found in Streamlit secrets.")
-            return None
-        
-        # Create credentials object
-        creds = service_account.Credentials.from_service_account_info(
-            creds_dict,
-            scopes=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        )
+        return optimizer.export_configuration(config, format="base45")
+    except ValueError:
+        return None
+
+def display_layout_decoder(optimizer, customer_info):
+    """Rebuild a tray layout from the code printed on its QR label"""
+    with st.expander("🔎 Decode Tray Layout"):
+        code = st.text_input("Layout code from a tray label", key="layout_code")
+        if code:
+            try:
+                config = optimizer.decode_layout(code)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                display_results(config, list(config["results"]), customer_info, key_prefix="decoded_")
+
+def display_labels(labels):
+    """QR code for a single tray, or a printable label sheet for several"""
+    if len(labels["serials"]) == 1:
+        st.subheader("Tray QR Code")
+        st.image(labels["images"][0], caption="Scan this QR code for tray information")
+        st.info(f"Tray Serial Number: {labels['serials'][0]}")
+        return
+
+    st.subheader(f"Tray QR Labels ({len(labels['serials'])} trays)")
+    st.image(labels["sheet"], caption="Label sheet")
+    if "pdf" not in labels:
+        labels["pdf"] = label_sheet(labels["images"], labels["captions"], format="PDF")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download Labels (PNG)", labels["sheet"], file_name="tray_labels.png",
+                           mime="image/png", key="labels_png")
+    with col2:
+        st.download_button("Download Labels (PDF)", labels["pdf"], file_name="tray_labels.pdf",
+                           mime="application/pdf", key="labels_pdf")
+    st.info(f"Tray Serial Numbers: {', '.join(labels['serials'])}")
+
+@st.cache_resource
+def get_shipment_spool():
+    """Process-wide write-behind queue for KCF rows; set KCF_SPOOL_PATH to move the SQLite file"""
+    creds_dict = get_sheets_creds()
+    spool = ShipmentSpool(
+        os.environ.get("KCF_SPOOL_PATH", "kcf_spool.sqlite3"),
+        sheet=lambda: get_kcf_sheet(creds_dict),
+    )
+    return spool.start()
 
-        # Authorize and get the sheet
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key('1ND6tVdQcH7_ZiYXWaS-wHjsvc2v0B4umtVp5b3-bYRc').worksheet('Sheet1')
-        
-        # Verify access
-        sheet.get_all_values()  # This will raise an exception if we can't access the sheet
-        return sheet
-    except gspread.exceptions.SpreadsheetNotFound:
-        st.error("Spreadsheet not found. Please check the spreadsheet ID.")
-    except gspread.exceptions.WorksheetNotFound:
-        st.error("Worksheet 'Sheet1' not found. Please check the worksheet name.")
-    except gspread.exceptions.APIError as e:
-        st.error(f"API Error: {str(e)}")
-        st.info("Please ensure the service account has been given access to the spreadsheet.")
+@st.cache_resource
+def get_kcf_mirror():
+    """Process-wide local copy of the KCF log; set KCF_MIRROR_PATH to move the SQLite file"""
+    creds_dict = get_sheets_creds()
+    return KCFMirror(os.environ.get("KCF_MIRROR_PATH", "kcf_mirror.sqlite3"),
+                     sheet=lambda: get_kcf_sheet(creds_dict))
+
+def sync_kcf_mirror(max_age=30):
+    """Pull new KCF rows into the mirror at most every max_age seconds; False if the sheet is unreachable"""
+    try:
+        get_kcf_mirror().sync(max_age=max_age)
+        return True
     except Exception as e:
-        st.error(f"Error initializing Google Sheets: {str(e)}")
-    
-    return None
-
-def generate_tray_serial():
-    return str(uuid.uuid4())[:8].upper()
-
-
-def generate_qr_code(data):
-    qr_data = (
-        f"KETOS Fluid Tray\n"
-        f"------------------\n"
-        f"Tray ID: {data['tray_serial']}\n"
-        f"Customer: {data['name']}\n"
-        f"Location: {data['unit']}\n"
-        f"Created: {data['date']}\n"
-        f"Operator: {data['operator']}\n"
-        f"Status: Active"
-    )
-    
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4
-    )
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Create base64 string
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+        st.warning(f"Shipment history may be out of date: {str(e)}")
+        return False
 
-# Update other functions ...
+# Function to update KCFtray2024.csv
 def update_kcf_summary(data):
-    sheet = init_google_sheets()
-    if sheet:
-        try:
-            sheet.append_row(data)
-            return True
-        except Exception as e:
-            st.error(f"Error updating Google Sheet: {str(e)}")
+    """Spool the row durably; the background writer appends it to the sheet"""
+    try:
+        get_shipment_spool().enqueue(data)
+        return True
+    except Exception as e:
+        st.error(f"Error recording KCF summary: {str(e)}")
     return False
 
-def check_google_sheet():
-    sheet = init_google_sheets()
-    if sheet:
-        try:
-            values = sheet.get_all_values()
-            if len(values) > 0:  # Check if the sheet has any data
-                return True
-        except Exception as e:
-            st.error(f"Error accessing Google Sheet: {str(e)}")
-    return False
+def display_spool_status():
+    stats = get_shipment_spool().stats()
+    st.sidebar.markdown("### 📤 KCF Sync")
+    col1, col2 = st.sidebar.columns(2)
+    col1.metric("Queued rows", stats["pending"])
+    col2.metric("Last flush", f"{stats['last_flush_ms']:.0f} ms" if stats["last_flush_ms"] is not None else "—")
+    if stats["last_error"]:
+        retry = f" Retrying in {stats['retry_in_s']:.0f} s." if stats["retry_in_s"] is not None else ""
+        st.sidebar.warning(f"Last sync failed: {stats['last_error']}.{retry}")
 
-# Function to update KCFtray2024.csv
-def update_kcf_summary(data):
+def check_google_sheet():
+    """Sheet health from a metadata probe, cached for a minute instead of a full read per rerun"""
     sheet = init_google_sheets()
     if sheet:
-        try:
-            sheet.append_row(data)
-            return True
-        except Exception as e:
-            st.error(f"Error updating KCF summary: {str(e)}")
+        ok, message = sheet.probe()
+        if not ok:
+            st.error(message)
+        return ok
     return False
 
 # Function to check if KCFtray2024.csv exists and is up-to-date
 def check_kcf_summary():
-    sheet = init_google_sheets()
-    if sheet:
-        try:
-            values = sheet.get_all_values()
-            if len(values) > 1:  # Assuming the first row is headers
-                return True
-        except Exception as e:
-            st.error(f"Error accessing KCFtray2024.csv: {str(e)}")
-    return False
+    return sync_kcf_mirror() and get_kcf_mirror().count() > 0
+
+def display_shipment_history():
+    """Look up past trays and monthly totals from the local KCF mirror"""
+    with st.expander("📚 Shipment History"):
+        mirror = get_kcf_mirror()
+        col1, col2 = st.columns([4, 1])
+        with col2:
+            if st.button("Full resync", key="history_resync"):
+                try:
+                    mirror.resync()
+                except Exception as e:
+                    st.error(f"Error resyncing shipment history: {str(e)}")
+        sync_kcf_mirror()
+
+        with col1:
+            field = st.selectbox("Search by", ["Customer", "Tray serial", "Tracking number", "Unit location"],
+                                 key="history_field")
+        query = st.text_input("Search", key="history_query")
+        dates = st.date_input("Shipped between", value=[], key="history_dates")
+        since, until = (tuple(dates) + (None, None))[:2]
+        filters = {
+            "Customer": "customer", "Tray serial": "serial",
+            "Tracking number": "tracking", "Unit location": "unit",
+        }
+        rows = mirror.find(since=since, until=until, **({filters[field]: query} if query else {}))
+        st.caption(f"{len(rows)} shipments shown, {mirror.count()} mirrored")
+        if rows:
+            history = pd.DataFrame(rows)[[
+                "serial", "shipped_at", "customer", "unit", "num_trays", "tracking", "operator"
+            ]]
+            history.columns = ["Tray Serial", "Shipped", "Customer", "Unit", "Trays", "Tracking", "Operator"]
+            st.dataframe(history, hide_index=True)
+
+        st.markdown("#### Trays shipped per customer per month")
+        summary = mirror.monthly_summary(customer=query if field == "Customer" else None)
+        if summary:
+            monthly = pd.DataFrame(summary).pivot_table(
+                index="customer", columns="month", values="trays", aggfunc="sum", fill_value=0
+            ).astype(int)
+            st.dataframe(monthly[sorted(monthly.columns, reverse=True)])
 
 def add_column_headers(sheet):
     try:
@@ -254,24 +338,17 @@ def add_column_headers(sheet):
     except Exception as e:
         st.error(f"Error adding column headers: {str(e)}")
 
+def get_reagent_catalog():
+    """Compiled reagent catalog, shared with the optimizer's lookups"""
+    return get_optimizer().catalog
+
 def get_reagent_color(reagent_code):
-    color_map = {
-        'gray': ['KR1E', 'KR1S', 'KR2S', 'KR3E', 'KR3S', 'KR4E', 'KR4S', 'KR5E', 'KR5S', 'KR6E1', 'KR6E2', 'KR6E3', 'KR13E1', 'KR13S', 'KR14E', 'KR14S', 'KR15E', 'KR15S'],
-        'violet': ['KR7E1', 'KR7E2', 'KR8E1', 'KR8E2', 'KR19E1', 'KR19E2', 'KR19E3', 'KR20E', 'KR36E1', 'KR36E2', 'KR40E1', 'KR40E2'],
-        'green': ['KR9E1', 'KR9E2', 'KR17E1', 'KR17E2', 'KR17E3', 'KR28E1', 'KR28E2', 'KR28E3'],
-        'orange': ['KR10E1', 'KR10E2', 'KR10E3', 'KR12E1', 'KR12E2', 'KR12E3', 'KR18E1', 'KR18E2', 'KR22E1', 'KR27E1', 'KR27E2', 'KR42E1', 'KR42E2'],
-        'white': ['KR11E', 'KR21E1'],
-        'blue': ['KR16E1', 'KR16E2', 'KR16E3', 'KR16E4', 'KR30E1', 'KR30E2', 'KR30E3', 'KR31E1', 'KR31E2', 'KR34E1', 'KR34E2'],
-        'red': ['KR29E1', 'KR29E2', 'KR29E3'],
-        'yellow': ['KR35E1', 'KR35E2']
-    }
-    for color, reagents in color_map.items():
-        if any(reagent_code.startswith(r) for r in reagents):
-            return color
-    return 'lightgray'
+    return get_reagent_catalog().color(reagent_code)
 
-def create_tray_visualization(config, customer_info):
+def create_tray_visualization(config, customer_info, geometry=None):
     locations = config["tray_locations"]
+    geometry = geometry or TrayGeometry.default()
+    _, columns = geometry.grid_shape
     fig = go.Figure()
 
     # Create the title with customer information
@@ -280,9 +357,9 @@ def create_tray_visualization(config, customer_info):
              f"Date: {customer_info['date'].strftime('%Y-%m-%d')}")
 
     for i, loc in enumerate(locations):
-        row = i // 4
+        row, col = geometry.grid_position(i)
         # Reverse the column calculation
-        col = 3 - (i % 4)  # This changes the direction from right to left
+        col = columns - 1 - col  # This changes the direction from right to left
         color = get_reagent_color(loc['reagent_code']) if loc else 'lightgray'
         opacity = 0.8 if loc else 0.2
 
@@ -330,15 +407,23 @@ def create_tray_visualization(config, customer_info):
 
     return fig
 
-def display_results(config, selected_experiments, customer_info):
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_tray_figure(fingerprint, customer_name, unit, date, _config):
+    """Tray figure, rebuilt only when the layout or the title fields change"""
+    return create_tray_visualization(_config, {"name": customer_name, "unit": unit, "date": date})
+
+def display_results(config, selected_experiments, customer_info, key_prefix=""):
     col1, col2 = st.columns([3, 2])
 
     with col1:
         st.subheader("Tray Configuration")
-        fig = create_tray_visualization(config, customer_info)
+        fig = get_tray_figure(
+            config_fingerprint(config), customer_info["name"], customer_info["unit"],
+            customer_info["date"], config
+        )
         st.plotly_chart(fig, use_container_width=True)
         
-        if st.button("Download Configuration Plot"):
+        if st.button("Download Configuration Plot", key=f"{key_prefix}download_plot"):
             fig.write_image("tray_configuration.png")
             st.success("Plot downloaded as 'tray_configuration.png'")
 
@@ -376,7 +461,7 @@ def display_results(config, selected_experiments, customer_info):
         ])
         st.dataframe(results_df, use_container_width=True)
 
-        if st.button("Download Results as CSV"):
+        if st.button("Download Results as CSV", key=f"{key_prefix}download_csv"):
             results_df.to_csv("tray_configuration_results.csv", index=False)
             st.success("Results downloaded as 'tray_configuration_results.csv'")
 
@@ -413,6 +498,66 @@ def display_results(config, selected_experiments, customer_info):
                 st.dataframe(locations_df, use_container_width=True)
 
 
+def display_plan(plan, customer_info):
+    """Show a multi-tray plan: fleet totals first, then one tab per tray"""
+    st.subheader("Fleet Summary")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Fleet Days of Operation", f"{plan['overall_days_of_operation']:.1f} days")
+    with col2:
+        st.metric("Trays", plan["num_trays"])
+
+    fleet_df = pd.DataFrame([
+        {
+            "Experiment": f"{result['name']} (#{exp_num})",
+            "Daily Tests": result["daily_count"],
+            "Total Tests": result["total_tests"],
+            "Days of Operation": result["days_of_operation"],
+            "Trays": ", ".join(str(t + 1) for t in result["trays"])
+        }
+        for exp_num, result in plan["results"].items()
+    ])
+    st.dataframe(fleet_df, use_container_width=True)
+
+    tabs = st.tabs([f"Tray {t + 1}" for t in range(plan["num_trays"])])
+    for t, (tab, config) in enumerate(zip(tabs, plan["trays"])):
+        with tab:
+            display_results(config, list(config["results"]), customer_info, key_prefix=f"tray{t}_")
+
+
+def display_what_if(optimizer, selected_experiments, daily_counts):
+    """Chart days of operation while one experiment's daily count varies"""
+    with st.expander("📈 What-if: daily test counts"):
+        exp_id = st.selectbox(
+            "Vary daily tests for",
+            selected_experiments,
+            format_func=lambda e: f"#{e}: {optimizer.catalog.experiment_names[e]}"
+        )
+        current = daily_counts.get(exp_id, 1)
+        low, high = st.slider("Daily test range", 1, max(50, current * 3), (1, max(20, current * 2)))
+
+        grid = {exp: (daily_counts.get(exp, 1),) for exp in selected_experiments}
+        grid[exp_id] = tuple(range(low, high + 1))
+        df = sweep_daily_counts(tuple(selected_experiments), tuple(sorted(grid.items())))
+
+        fig = go.Figure(go.Scatter(
+            x=df[f"daily_count_{exp_id}"],
+            y=df["overall_days_of_operation"],
+            mode="lines+markers",
+            customdata=df["limiting_experiment"],
+            hovertemplate="%{x} tests/day: %{y:.1f} days<br>limited by #%{customdata}<extra></extra>"
+        ))
+        fig.add_vline(x=current, line_dash="dash", line_color="gray")
+        fig.update_layout(
+            xaxis_title=f"Daily tests for #{exp_id}",
+            yaxis_title="Days of operation",
+            height=350,
+            margin=dict(l=20, r=20, t=20, b=20)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(f"{int(df['solved'].sum())} of {len(df)} points needed a fresh optimization")
+
+
 def reset_app():
     """Clears all session state variables to reset the app."""
     for key in list(st.session_state.keys()):
@@ -420,6 +565,8 @@ def reset_app():
     
     # Reinitialize essential session state variables
     st.session_state.config = None
+    st.session_state.plan = None
+    st.session_state.labels = None
     st.session_state.selected_experiments = []
     st.session_state.daily_counts = {}
     
@@ -429,7 +576,7 @@ def reset_app():
     st.session_state.operator_name = ""
     
     # Reset experiment selection checkboxes
-    for exp in ReagentOptimizer().get_available_experiments():
+    for exp in get_optimizer().get_available_experiments():
         st.session_state[f"exp_{exp['id']}"] = False
         st.session_state[f"exp_{exp['id']}_hr"] = False
         st.session_state[f"exp_{exp['id']}_other"] = False
@@ -441,6 +588,10 @@ def main():
     # Initialize session state
     if 'config' not in st.session_state:
         st.session_state.config = None
+    if 'plan' not in st.session_state:
+        st.session_state.plan = None
+    if 'labels' not in st.session_state:
+        st.session_state.labels = None
     if 'selected_experiments' not in st.session_state:
         st.session_state.selected_experiments = []
     if 'daily_counts' not in st.session_state:
@@ -453,6 +604,7 @@ def main():
         st.info("Please ensure the GOOGLE_SHEETS_CREDS environment variable is set correctly in your Streamlit Cloud settings and the service account has access to the sheet.")
     else:
         st.success("Google Sheets integration is working correctly.")
+    display_spool_status()
 
     # Customer Information Section
     st.sidebar.markdown("### 📝 Customer Information")
@@ -473,18 +625,13 @@ def main():
         reset_app()
         st.rerun()
 
-    optimizer = ReagentOptimizer()
-    experiments = optimizer.get_available_experiments()
+    optimizer = get_optimizer()
 
     # Experiment Selection Section
     st.sidebar.markdown("### 1️⃣ Select Experiments")
     
     # Group experiments by type
-    exp_types = {
-        "LR": [exp for exp in experiments if "(LR)" in exp["name"]],
-        "HR": [exp for exp in experiments if "(HR)" in exp["name"]],
-        "Other": [exp for exp in experiments if "(LR)" not in exp["name"] and "(HR)" not in exp["name"]]
-    }
+    exp_types = get_experiment_groups()
 
     selected_experiments = []
     
@@ -533,7 +680,7 @@ def main():
         daily_counts = {}
         
         for exp_id in selected_experiments:
-            exp_name = next(exp['name'] for exp in experiments if exp['id'] == exp_id)
+            exp_name = optimizer.catalog.experiment_names[exp_id]
             count = st.sidebar.number_input(
                 f"#{exp_id}: {exp_name}",
                 min_value=1,
@@ -549,6 +696,20 @@ def main():
         st.sidebar.markdown(f"**Total experiments:** {len(selected_experiments)}")
         st.sidebar.markdown(f"**Total daily tests:** {sum(daily_counts.values())}")
 
+        time_budget = st.sidebar.number_input(
+            "Optimization time budget (ms)", min_value=50, max_value=10000, value=500, step=50,
+            help="The fast layout is refined until this budget runs out"
+        )
+        use_portfolio = st.sidebar.checkbox(
+            "Run competing strategies in parallel",
+            help="Races several placement orderings and the exact solver on all CPU cores"
+        )
+
+        tray_count = st.sidebar.number_input(
+            "Number of trays", min_value=1, max_value=10, value=1, step=1,
+            help="Orders that do not fit on one tray are split over as many trays as needed"
+        )
+
         optimize_button = st.sidebar.button("3️⃣ Optimize Configuration", key="optimize_button")
 
         if optimize_button:
@@ -556,27 +717,60 @@ def main():
                 st.error("Please fill in Customer Name, Unit Location, and Operator Name before optimizing.")
             else:
                 try:
-                    with st.spinner("Optimizing tray configuration..."):
-                        config = optimizer.optimize_tray_configuration(selected_experiments, daily_counts)
-                    st.session_state.config = config
-                    st.session_state.selected_experiments = selected_experiments
-                    
-                    # Show optimization summary
-                    used_locations = len([loc for loc in config["tray_locations"] if loc is not None])
-                    st.success(f"""
-                    Configuration optimized successfully:
-                    - All {used_locations} locations utilized
-                    - Optimized for maximum days of operation
-                    - Multiple sets added where beneficial
-                    """)
-                    
+                    if tray_count > 1 or total_locations_needed > optimizer.MAX_LOCATIONS:
+                        with st.spinner("Planning trays..."):
+                            plan = plan_order(
+                                tuple(selected_experiments), tuple(sorted(daily_counts.items())),
+                                tray_count if tray_count > 1 else None
+                            )
+                        st.session_state.plan = plan
+                        st.session_state.config = plan["trays"][0]
+                        st.session_state.selected_experiments = selected_experiments
+                        st.success(
+                            f"Order planned on {plan['num_trays']} {plan['strategy']} trays: "
+                            f"{plan['overall_days_of_operation']:.1f} days of operation"
+                        )
+                    else:
+                        with st.spinner("Optimizing tray configuration..."):
+                            config = solve_order(
+                                tuple(selected_experiments), tuple(sorted(daily_counts.items())),
+                                time_budget, use_portfolio
+                            )
+                        st.session_state.config = config
+                        st.session_state.plan = None
+                        st.session_state.selected_experiments = selected_experiments
+
+                        # Show optimization summary
+                        used_locations = len([loc for loc in config["tray_locations"] if loc is not None])
+                        st.success(f"""
+                        Configuration optimized successfully:
+                        - All {used_locations} locations utilized
+                        - Optimized for maximum days of operation
+                        - Multiple sets added where beneficial
+                        """)
+                        proof = "proven optimal" if config["proven_optimal"] else "best found within the time budget"
+                        if "portfolio" in config:
+                            portfolio = config["portfolio"]
+                            st.caption(
+                                f"Solved in {portfolio['elapsed_ms']:.1f} ms by the "
+                                f"{portfolio['winner']} strategy, {proof}"
+                            )
+                        else:
+                            stats = config["stats"]
+                            phases = ", ".join(f"{phase} {ms:.1f} ms" for phase, ms in stats["timings_ms"].items())
+                            st.caption(f"Solved in {stats['total_ms']:.1f} ms, {proof} ({phases})")
+
                 except ValueError as e:
                     st.error(str(e))
                 except Exception as e:
                     st.error(f"An error occurred: {str(e)}")
 
     if st.session_state.config is not None:
-        display_results(st.session_state.config, st.session_state.selected_experiments, customer_info)
+        if st.session_state.plan is not None:
+            display_plan(st.session_state.plan, customer_info)
+        else:
+            display_results(st.session_state.config, st.session_state.selected_experiments, customer_info)
+            display_what_if(optimizer, st.session_state.selected_experiments, st.session_state.daily_counts)
 
         # QC Questionnaire
         st.subheader("QC Questionnaire")
@@ -585,7 +779,8 @@ def main():
         qc3 = st.checkbox("3. Box is carried to FedEx by KETOS for 2-day Air or Ground shipping only?")
 
         # Number of Fluid Trays Produced
-        num_trays = st.number_input("Number of Fluid Trays Produced", min_value=1, value=1, step=1)
+        planned_trays = st.session_state.plan["num_trays"] if st.session_state.plan else 1
+        num_trays = st.number_input("Number of Fluid Trays Produced", min_value=1, value=planned_trays, step=1)
 
         # Tracking Number Input
         tracking_number = st.text_input("Tracking Number")
@@ -593,50 +788,60 @@ def main():
         # Ship Button
         if st.button("Mark as Shipped"):
             if qc1 and qc2 and qc3 and tracking_number:
-                # Generate tray serial number and QR code
-                tray_serial = generate_tray_serial()
-               
-                qr_data = {
-                    'tray_serial': tray_serial,
-                    'name': customer_info['name'],
-                    'unit': customer_info['unit'],
-                    'date': config_date.strftime('%Y-%m-%d'),
-                    'operator': customer_info['operator']
-                }
-                
-                qr_code_base64 = generate_qr_code(qr_data)
-                
-                # Prepare data for KCF summary
-                kcf_data = [
-                    tray_serial,
-                    datetime.now().strftime("%m/%d/%Y %H:%M"),
-                    customer_info['name'],
-                    customer_info['unit'],
-                    num_trays,
-                    tracking_number,
-                    "Yes" if qc1 else "No",
-                    "Yes" if qc2 else "No",
-                    "Yes" if qc3 else "No",
-                    customer_info['operator'],
-                    qr_code_base64  
+                # One serial, QR label and KCF row per tray
+                shipped_at = datetime.now().strftime("%m/%d/%Y %H:%M")
+                tray_configs = st.session_state.plan["trays"] if st.session_state.plan else []
+                records = [
+                    {
+                        'tray_serial': serial,
+                        'name': customer_info['name'],
+                        'unit': customer_info['unit'],
+                        'date': config_date.strftime('%Y-%m-%d'),
+                        'operator': customer_info['operator'],
+                        'layout': layout_code(
+                            optimizer, tray_configs[t] if t < len(tray_configs) else st.session_state.config
+                        )
+                    }
+                    for t, serial in enumerate(generate_tray_serials(int(num_trays)))
                 ]
-                
-                if sheets_integration_status:
-                    if update_kcf_summary(kcf_data):
-                        st.success("Tray marked as shipped and KCF summary updated successfully!")
+                with st.spinner("Generating tray labels..."):
+                    st.session_state.labels = batch_labels(records)
+
+                # The sheet keeps the QR payload text; the image can be rendered again from it
+                recorded = [
+                    update_kcf_summary([
+                        record['tray_serial'],
+                        shipped_at,
+                        customer_info['name'],
+                        customer_info['unit'],
+                        1,
+                        tracking_number,
+                        "Yes" if qc1 else "No",
+                        "Yes" if qc2 else "No",
+                        "Yes" if qc3 else "No",
+                        customer_info['operator'],
+                        payload
+                    ])
+                    for record, payload in zip(records, st.session_state.labels["payloads"])
+                ]
+
+                if all(recorded):
+                    if sheets_integration_status:
+                        st.success("Trays marked as shipped; the KCF summary rows are queued for upload.")
                     else:
-                        st.error("Failed to update KCF summary. Please try again or contact support.")
+                        st.warning("Trays marked as shipped. The KCF summary rows are saved locally and will be "
+                                   "uploaded once Google Sheets is reachable.")
                 else:
-                    st.warning("KCF summary could not be updated due to Google Sheets integration issues.")
-                
-                # Display QR code
-                st.subheader("Tray QR Code")
-                qr_image = f"data:image/png;base64,{qr_code_base64}"
-                st.image(qr_image, caption="Scan this QR code for tray information")
-                st.info(f"Tray Serial Number: {tray_serial}")
+                    st.error("Failed to record KCF summary. Please try again or contact support.")
             else:
                 st.error("Please complete all QC checks and provide a tracking number before shipping.")
 
+        if st.session_state.labels:
+            display_labels(st.session_state.labels)
+
+
+    display_layout_decoder(optimizer, customer_info)
+    display_shipment_history()
 
     # Help and Information
     with st.sidebar.expander("ℹ️ Help & Information"):
@@ -0,0 +1,245 @@
+"""Reproducible benchmark for ReagentOptimizer
+
+Generates an order corpus, times every optimization method on it, reports the
+optimizer's own search statistics (phase timings and candidate placements
+evaluated per call), records peak memory, and compares
+achieved days of operation with an exhaustive optimum on small orders.
+Results are written as JSON; pass --baseline to fail on regressions.
+
+    python benchmarks/optimizer_benchmark.py --out bench.json
+    python benchmarks/optimizer_benchmark.py --baseline bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reagent_optimizer import ReagentOptimizer  # noqa: E402
+
+# Share of orders by daily test count, roughly as seen across customer units
+DAILY_COUNT_WEIGHTS = {1: 30, 2: 20, 3: 15, 5: 15, 8: 10, 12: 6, 20: 4}
+
+# High-volume experiments that compete for the large locations
+WORST_CASE_MIXES = [
+    [10, 16, 28],
+    [7, 10, 16, 28],
+    [10, 16, 28, 36, 40],
+    [10, 16, 19, 28, 29],
+]
+
+METHODS = ["greedy", "exact", "dp"]
+
+
+def generate_corpus(optimizer, num_orders, seed, max_experiments=8):
+    """Random experiment subsets with realistic daily counts, plus worst-case mixes"""
+    rng = random.Random(seed)
+    experiment_ids = list(optimizer.experiment_data)
+    counts, weights = zip(*DAILY_COUNT_WEIGHTS.items())
+
+    def daily_counts(experiments, scale=1):
+        return {exp: rng.choices(counts, weights)[0] * scale for exp in experiments}
+
+    orders = []
+    for mix in WORST_CASE_MIXES:
+        orders.append({"experiments": mix, "daily_counts": daily_counts(mix, scale=2), "kind": "worst_case"})
+    while len(orders) < num_orders:
+        experiments = rng.sample(experiment_ids, rng.randint(1, max_experiments))
+        orders.append({"experiments": experiments, "daily_counts": daily_counts(experiments), "kind": "random"})
+    return orders
+
+
+def exhaustive_optimum(optimizer, experiments, daily_counts):
+    """Best days of operation over every set placement, by brute force"""
+    classes = optimizer._capacity_classes()
+    capacities = [cap for cap, _ in classes]
+    class_counts = [len(locs) for _, locs in classes]
+
+    def distributions(num_slots, counts):
+        return [
+            dist for dist in itertools.product(*(range(min(c, num_slots) + 1) for c in counts))
+            if sum(dist) == num_slots
+        ]
+
+    per_experiment = []
+    for exp in experiments:
+        reagents = optimizer.experiment_data[exp]["reagents"]
+        options = []
+        for num_sets in range(1, optimizer.MAX_LOCATIONS // len(reagents) + 1):
+            dists = distributions(num_sets, class_counts)
+            for choice in itertools.product(dists, repeat=len(reagents)):
+                usage = [sum(d[c] for d in choice) for c in range(len(class_counts))]
+                if any(u > c for u, c in zip(usage, class_counts)):
+                    continue
+                tests = min(
+                    sum(n * optimizer.calculate_tests(r["vol"], cap) for n, cap in zip(dist, capacities))
+                    for dist, r in zip(choice, reagents)
+                )
+                options.append((usage, tests / daily_counts[exp]))
+        per_experiment.append(options)
+
+    best = 0
+    for combo in itertools.product(*per_experiment):
+        usage = [sum(option[0][c] for option in combo) for c in range(len(class_counts))]
+        if all(u <= c for u, c in zip(usage, class_counts)):
+            best = max(best, min(option[1] for option in combo))
+    return best
+
+
+def candidate_count(stats):
+    """Candidate placements scored during one call, from its search statistics"""
+    counters = stats["counters"]
+    return counters.get("candidates_evaluated", 0) + counters.get("options_enumerated", 0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_method(method, corpus, small_orders):
+    optimizer = ReagentOptimizer()
+    instrumented = ReagentOptimizer(instrument=True)
+
+    times_ms = []
+    errors = 0
+    for order in corpus:
+        start = time.perf_counter()
+        try:
+            optimizer.optimize_tray_configuration(order["experiments"], order["daily_counts"], method=method)
+        except ValueError:
+            errors += 1
+            continue
+        times_ms.append((time.perf_counter() - start) * 1000)
+
+    # Search statistics come from an instrumented pass so they do not affect the timings
+    candidates = []
+    phase_ms = {}
+    for order in corpus:
+        try:
+            config = instrumented.optimize_tray_configuration(
+                order["experiments"], order["daily_counts"], method=method
+            )
+        except ValueError:
+            continue
+        candidates.append(candidate_count(config["stats"]))
+        for phase, ms in config["stats"]["timings_ms"].items():
+            phase_ms.setdefault(phase, []).append(ms)
+
+    # Memory is measured in a separate pass so tracing does not distort the timings
+    peak_kb = 0
+    tracemalloc.start()
+    for order in corpus:
+        tracemalloc.reset_peak()
+        try:
+            optimizer.optimize_tray_configuration(order["experiments"], order["daily_counts"], method=method)
+        except ValueError:
+            continue
+        peak_kb = max(peak_kb, tracemalloc.get_traced_memory()[1] / 1024)
+    tracemalloc.stop()
+
+    ratios = []
+    for order, optimum in small_orders:
+        config = optimizer.optimize_tray_configuration(order["experiments"], order["daily_counts"], method=method)
+        ratios.append(config["overall_days_of_operation"] / optimum)
+
+    return {
+        "calls": len(times_ms),
+        "errors": errors,
+        "time_ms": {
+            "mean": statistics.mean(times_ms),
+            "p50": percentile(times_ms, 0.5),
+            "p95": percentile(times_ms, 0.95),
+            "max": max(times_ms),
+        },
+        "phase_ms": {phase: statistics.mean(values) for phase, values in phase_ms.items()},
+        "candidates_per_call": statistics.mean(candidates),
+        "peak_memory_kb": round(peak_kb, 1),
+        "quality": {
+            "instances": len(ratios),
+            "optimal": sum(1 for r in ratios if r >= 1 - 1e-9),
+            "mean_ratio": statistics.mean(ratios),
+            "min_ratio": min(ratios),
+        },
+    }
+
+
+def compare(results, baseline, max_slowdown):
+    """Return a list of regressions against a previous benchmark run"""
+    problems = []
+    for method, current in results["methods"].items():
+        previous = baseline.get("methods", {}).get(method)
+        if previous is None:
+            continue
+        if current["time_ms"]["mean"] > previous["time_ms"]["mean"] * max_slowdown:
+            problems.append(
+                f"{method}: mean time {current['time_ms']['mean']:.2f} ms vs "
+                f"{previous['time_ms']['mean']:.2f} ms baseline"
+            )
+        if current["quality"]["mean_ratio"] < previous["quality"]["mean_ratio"] - 1e-9:
+            problems.append(
+                f"{method}: mean quality ratio {current['quality']['mean_ratio']:.4f} vs "
+                f"{previous['quality']['mean_ratio']:.4f} baseline"
+            )
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    parser.add_argument("--orders", type=int, default=200, help="size of the timed corpus")
+    parser.add_argument("--small-orders", type=int, default=20,
+                        help="orders of at most 3 experiments checked against the exhaustive optimum")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="previous results to check for regressions")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="allowed ratio of mean time against the baseline")
+    args = parser.parse_args(argv)
+
+    reference = ReagentOptimizer()
+    corpus = generate_corpus(reference, args.orders, args.seed)
+    small_orders = [
+        (order, exhaustive_optimum(reference, order["experiments"], order["daily_counts"]))
+        for order in generate_corpus(reference, args.small_orders + len(WORST_CASE_MIXES),
+                                     args.seed + 1, max_experiments=3)
+        if order["kind"] == "random"
+    ]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "orders": len(corpus),
+            "small_orders": len(small_orders),
+        },
+        "methods": {method: run_method(method, corpus, small_orders) for method in args.methods},
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.max_slowdown)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
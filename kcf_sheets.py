@@ -0,0 +1,531 @@
+"""Google Sheets access for the KCF shipment log
+
+One authorized client and worksheet handle is kept per credential and
+sheet, shared by every caller in the process. Health checks read only
+spreadsheet metadata and cache the answer for a short TTL instead of
+downloading the sheet. LocalSheet stands in for the real worksheet in tests
+and offline runs; set KCF_LOCAL_SHEET to a CSV path (or ":memory:") or call
+set_kcf_sheet() to inject one.
+
+ShipmentSpool takes shipment rows immediately into a local SQLite file and a
+background thread appends them to the sheet in batches, retrying with
+exponential backoff; a row is keyed by its tray serial so it is written once.
+KCFMirror keeps an indexed SQLite copy of the log for lookups and reports,
+fetching only rows appended since its last sync.
+"""
+import csv
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SPREADSHEET_KEY = '1ND6tVdQcH7_ZiYXWaS-wHjsvc2v0B4umtVp5b3-bYRc'
+WORKSHEET_NAME = 'Sheet1'
+SCOPES = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+# Columns of a KCF row as written by the app, A through K
+LOG_COLUMNS = [
+    "serial", "shipped_at", "customer", "unit", "num_trays", "tracking",
+    "qc_packed", "qc_sealed", "qc_carried", "operator", "qr",
+]
+LAST_COLUMN = chr(ord("A") + len(LOG_COLUMNS) - 1)
+
+
+def describe_error(error):
+    """Operator-facing message for a Sheets failure"""
+    import gspread
+
+    if isinstance(error, gspread.exceptions.SpreadsheetNotFound):
+        return "Spreadsheet not found. Please check the spreadsheet ID."
+    if isinstance(error, gspread.exceptions.WorksheetNotFound):
+        return f"Worksheet '{WORKSHEET_NAME}' not found. Please check the worksheet name."
+    if isinstance(error, gspread.exceptions.APIError):
+        return (f"API Error: {error}. Please ensure the service account has been given "
+                f"access to the spreadsheet.")
+    return f"Error accessing Google Sheets: {error}"
+
+
+class KCFSheet:
+    """Pooled gspread worksheet with a TTL-cached health probe"""
+
+    def __init__(self, creds_info, spreadsheet_key=SPREADSHEET_KEY, worksheet=WORKSHEET_NAME,
+                 probe_ttl=60.0):
+        self.creds_info = creds_info
+        self.spreadsheet_key = spreadsheet_key
+        self.worksheet_name = worksheet
+        self.probe_ttl = probe_ttl
+        self._lock = threading.RLock()
+        self._worksheet = None
+        self._probe = None
+
+    def worksheet(self):
+        """Authorize and open the worksheet once, then reuse the handle"""
+        with self._lock:
+            if self._worksheet is None:
+                import gspread
+                from google.oauth2 import service_account
+
+                creds = service_account.Credentials.from_service_account_info(self.creds_info, scopes=SCOPES)
+                client = gspread.authorize(creds)
+                self._worksheet = client.open_by_key(self.spreadsheet_key).worksheet(self.worksheet_name)
+            return self._worksheet
+
+    def reset(self):
+        """Drop the client so the next call authorizes again"""
+        with self._lock:
+            self._worksheet = None
+            self._probe = None
+
+    def _call(self, operation):
+        import gspread
+
+        try:
+            return operation(self.worksheet())
+        except gspread.exceptions.APIError as e:
+            # Expired or revoked tokens get one fresh authorization
+            if getattr(e, "code", None) not in (401, 403):
+                raise
+            self.reset()
+            return operation(self.worksheet())
+
+    def probe(self):
+        """Return (ok, message), reading spreadsheet metadata at most once per TTL"""
+        with self._lock:
+            if self._probe is not None and time.monotonic() < self._probe[0]:
+                return self._probe[1]
+        try:
+            self._call(lambda ws: ws.spreadsheet.fetch_sheet_metadata(
+                params={"fields": "sheets.properties.title"}
+            ))
+            result, ttl = (True, None), self.probe_ttl
+        except Exception as e:
+            self.reset()
+            # Failures are retried sooner so a fixed outage clears quickly
+            result, ttl = (False, describe_error(e)), min(self.probe_ttl, 10.0)
+        with self._lock:
+            self._probe = (time.monotonic() + ttl, result)
+        return result
+
+    def append_row(self, row):
+        return self._call(lambda ws: ws.append_row(row))
+
+    def append_rows(self, rows):
+        return self._call(lambda ws: ws.append_rows(rows))
+
+    def get_all_values(self):
+        return self._call(lambda ws: ws.get_all_values())
+
+    def col_values(self, col):
+        return self._call(lambda ws: ws.col_values(col))
+
+    def get_rows(self, start_row):
+        """Rows from start_row (1-based) to the end of the log"""
+        return self._call(lambda ws: ws.get(f"A{start_row}:{LAST_COLUMN}"))
+
+    def update(self, cell_range, values):
+        return self._call(lambda ws: ws.update(cell_range, values))
+
+    def format(self, cell_range, cell_format):
+        return self._call(lambda ws: ws.format(cell_range, cell_format))
+
+    def __repr__(self):
+        return f"KCFSheet(spreadsheet={self.spreadsheet_key!r}, worksheet={self.worksheet_name!r})"
+
+
+class LocalSheet:
+    """In-memory or CSV-backed stand-in for the KCF worksheet
+
+    failures makes that many upcoming writes raise ConnectionError and latency
+    delays every write, to exercise retries offline.
+    """
+
+    def __init__(self, path=None, failures=0, latency=0.0):
+        self.path = path
+        self.rows = []
+        self.failures = failures
+        self.latency = latency
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, newline="") as f:
+                self.rows = [row for row in csv.reader(f)]
+
+    def probe(self):
+        return True, None
+
+    def append_row(self, row):
+        self.append_rows([row])
+
+    def append_rows(self, rows):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("Simulated Sheets outage")
+            rows = [[str(value) for value in row] for row in rows]
+            self.rows.extend(rows)
+            if self.path:
+                with open(self.path, "a", newline="") as f:
+                    csv.writer(f).writerows(rows)
+
+    def get_all_values(self):
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def col_values(self, col):
+        with self._lock:
+            return [row[col - 1] for row in self.rows if len(row) >= col]
+
+    def get_rows(self, start_row):
+        with self._lock:
+            return [list(row) for row in self.rows[start_row - 1:]]
+
+    def update(self, cell_range, values):
+        # Only whole leading rows are supported, which is all the app writes
+        with self._lock:
+            for i, row in enumerate(values):
+                if i < len(self.rows):
+                    self.rows[i] = [str(value) for value in row]
+                else:
+                    self.rows.append([str(value) for value in row])
+            self._rewrite()
+
+    def format(self, cell_range, cell_format):
+        pass
+
+    def _rewrite(self):
+        if self.path:
+            with open(self.path, "w", newline="") as f:
+                csv.writer(f).writerows(self.rows)
+
+    def __repr__(self):
+        return f"LocalSheet(path={self.path!r}, rows={len(self.rows)})"
+
+
+_sheets = {}
+_sheets_lock = threading.Lock()
+_override = None
+
+
+def set_kcf_sheet(sheet):
+    """Make every get_kcf_sheet() call return sheet (None restores normal lookup)"""
+    global _override
+    _override = sheet
+
+
+def get_kcf_sheet(creds_info=None, spreadsheet_key=SPREADSHEET_KEY, worksheet=WORKSHEET_NAME):
+    """Shared sheet for these credentials, a local stand-in, or None without credentials"""
+    if _override is not None:
+        return _override
+    local_path = os.environ.get("KCF_LOCAL_SHEET")
+    if local_path:
+        key = ("local", local_path)
+        factory = lambda: LocalSheet(None if local_path == ":memory:" else local_path)
+    elif creds_info:
+        key = (creds_info.get("client_email"), spreadsheet_key, worksheet)
+        factory = lambda: KCFSheet(dict(creds_info), spreadsheet_key, worksheet)
+    else:
+        return None
+    with _sheets_lock:
+        if key not in _sheets:
+            _sheets[key] = factory()
+        return _sheets[key]
+
+
+class ShipmentSpool:
+    """Durable write-behind queue of KCF rows, keyed on the tray serial in column A
+
+    sheet is a callable returning the current sheet (or None while it is
+    unavailable), so credentials and the pooled client are looked up on
+    every flush.
+    """
+
+    def __init__(self, path, sheet, batch_size=50, base_backoff=1.0, max_backoff=300.0):
+        self.path = path
+        self.sheet = sheet
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "serial TEXT PRIMARY KEY, row TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, sent_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS spool_pending ON spool (sent_at, enqueued_at)")
+        self.flushes = 0
+        self.flush_ms_total = 0.0
+        self.last_flush_ms = None
+        self.last_error = None
+        self.retry_at = 0.0
+
+    def enqueue(self, row):
+        """Store a row durably and wake the writer; False if its serial is already spooled"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO spool (serial, row, enqueued_at) VALUES (?, ?, ?)",
+                (str(row[0]), json.dumps(row, default=str), time.time()),
+            )
+        self._wake.set()
+        return cursor.rowcount == 1
+
+    def flush(self):
+        """Append one batch of pending rows; returns how many were written"""
+        with self._lock:
+            batch = self._db.execute(
+                "SELECT serial, row, attempts FROM spool WHERE sent_at IS NULL "
+                "ORDER BY enqueued_at LIMIT ?", (self.batch_size,)
+            ).fetchall()
+        if not batch:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            sheet = self.sheet()
+            if sheet is None:
+                raise ConnectionError("Google Sheets is not configured")
+            rows = [(serial, json.loads(row)) for serial, row, _ in batch]
+            if any(attempts for _, _, attempts in batch):
+                # A failed call may still have landed, so skip serials already on the sheet
+                written = set(sheet.col_values(1))
+                rows = [(serial, row) for serial, row in rows if serial not in written]
+            if rows:
+                sheet.append_rows([row for _, row in rows])
+        except Exception as e:
+            attempts = max(a for _, _, a in batch) + 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+            with self._lock, self._db:
+                self._db.executemany(
+                    "UPDATE spool SET attempts = attempts + 1 WHERE serial = ?",
+                    [(serial,) for serial, _, _ in batch],
+                )
+                self.last_error = str(e)
+                self.retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+            logger.warning("KCF spool flush of %d rows failed (attempt %d): %s", len(batch), attempts, e)
+            return 0
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE spool SET sent_at = ? WHERE serial = ?",
+                [(time.time(), serial) for serial, _, _ in batch],
+            )
+            self.flushes += 1
+            self.flush_ms_total += elapsed_ms
+            self.last_flush_ms = elapsed_ms
+            self.last_error = None
+            self.retry_at = 0.0
+        return len(batch)
+
+    def drain(self):
+        """Flush until the queue is empty or a flush fails"""
+        total = 0
+        while True:
+            written = self.flush()
+            total += written
+            if written == 0:
+                return total
+
+    def start(self):
+        """Run the writer in a daemon thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="kcf-spool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                self._wake.wait(wait)
+                self._wake.clear()
+                continue
+            if self.drain() == 0 and not self.retry_at:
+                self._wake.wait()
+                self._wake.clear()
+
+    def stats(self):
+        """Queue depth and flush latency for display"""
+        with self._lock:
+            pending, oldest = self._db.execute(
+                "SELECT COUNT(*), MIN(enqueued_at) FROM spool WHERE sent_at IS NULL"
+            ).fetchone()
+            sent = self._db.execute("SELECT COUNT(*) FROM spool WHERE sent_at IS NOT NULL").fetchone()[0]
+            return {
+                "pending": pending,
+                "sent": sent,
+                "oldest_pending_s": time.time() - oldest if oldest else None,
+                "flushes": self.flushes,
+                "last_flush_ms": self.last_flush_ms,
+                "mean_flush_ms": self.flush_ms_total / self.flushes if self.flushes else None,
+                "last_error": self.last_error,
+                "retry_in_s": max(0.0, self.retry_at - time.monotonic()) if self.retry_at else None,
+            }
+
+    def close(self):
+        self.stop(timeout=5)
+        with self._lock:
+            self._db.close()
+
+
+def _parse_shipped_at(value):
+    for fmt in ("%m/%d/%Y %H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M")
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class KCFMirror:
+    """Indexed local SQLite copy of the KCF log, synced by row watermark
+
+    The sheet is append-only in practice, so each sync fetches only rows
+    below the last one mirrored; resync() rebuilds from scratch if rows were
+    edited in place.
+    """
+
+    def __init__(self, path, sheet):
+        self.path = path
+        self.sheet = sheet
+        self.last_sync = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        columns = ", ".join(f"{name} TEXT" for name in LOG_COLUMNS if name != "num_trays")
+        with self._lock, self._db:
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS shipments (row INTEGER PRIMARY KEY, num_trays INTEGER, {columns})"
+            )
+            for name in ("serial", "customer", "unit", "shipped_at", "tracking"):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS shipments_{name} ON shipments ({name})")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @property
+    def watermark(self):
+        """Last sheet row copied into the mirror"""
+        with self._lock:
+            value = self._db.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        return int(value[0]) if value else 0
+
+    def sync(self, max_age=None):
+        """Copy rows appended since the watermark; returns how many were added
+
+        With max_age, skip the remote call if the last sync is more recent
+        than that many seconds.
+        """
+        if max_age is not None and self.last_sync is not None and time.monotonic() - self.last_sync < max_age:
+            return 0
+        sheet = self.sheet()
+        if sheet is None:
+            raise ConnectionError("Google Sheets is not configured")
+        watermark = self.watermark
+        rows = sheet.get_rows(watermark + 1)
+        records = []
+        for offset, row in enumerate(rows):
+            row = list(row) + [""] * (len(LOG_COLUMNS) - len(row))
+            record = dict(zip(LOG_COLUMNS, row))
+            shipped_at = _parse_shipped_at(record["shipped_at"])
+            if shipped_at is None and watermark + offset == 0:
+                continue  # header row
+            record["shipped_at"] = shipped_at
+            try:
+                record["num_trays"] = int(record["num_trays"])
+            except (TypeError, ValueError):
+                record["num_trays"] = None
+            record["row"] = watermark + offset + 1
+            records.append(record)
+
+        names = ["row"] + LOG_COLUMNS
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO shipments ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' for _ in names)})",
+                [[record[name] for name in names] for record in records],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)",
+                (str(watermark + len(rows)),),
+            )
+        self.last_sync = time.monotonic()
+        return len(records)
+
+    def resync(self):
+        """Drop the mirror and copy the whole sheet again"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM shipments")
+            self._db.execute("DELETE FROM meta")
+        self.last_sync = None
+        return self.sync()
+
+    def find(self, serial=None, customer=None, unit=None, tracking=None, since=None, until=None, limit=200):
+        """Shipments matching every given filter, newest first
+
+        customer and unit match case-insensitively as substrings; since and
+        until are dates or "YYYY-MM-DD" strings.
+        """
+        clauses, params = [], []
+        for name, value in (("serial", serial), ("tracking", tracking)):
+            if value:
+                clauses.append(f"{name} = ?")
+                params.append(value.strip().upper() if name == "serial" else value.strip())
+        for name, value in (("customer", customer), ("unit", unit)):
+            if value:
+                clauses.append(f"{name} LIKE ?")
+                params.append(f"%{value.strip()}%")
+        if since:
+            clauses.append("shipped_at >= ?")
+            params.append(str(since))
+        if until:
+            clauses.append("shipped_at < date(?, '+1 day')")
+            params.append(str(until))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM shipments {where} ORDER BY shipped_at DESC, row DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def monthly_summary(self, customer=None):
+        """Shipments and trays per customer per month
+
+        Trays of one shipment share a tracking number, so shipments count
+        distinct tracking numbers.
+        """
+        where, params = ("WHERE customer LIKE ?", [f"%{customer.strip()}%"]) if customer else ("", [])
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT customer, substr(shipped_at, 1, 7) AS month, "
+                f"COUNT(DISTINCT COALESCE(NULLIF(tracking, ''), serial)) AS shipments, "
+                f"SUM(COALESCE(num_trays, 1)) AS trays FROM shipments {where} "
+                f"GROUP BY customer, month ORDER BY month DESC, customer",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM shipments").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,154 @@
+"""Batch QR labels for fluid trays
+
+Serials for a shipment are generated together, their QR codes are rendered
+in parallel worker processes, and the codes are laid out on one printable
+sheet (PNG or PDF). Rendered codes are cached by payload, so reprinting or
+re-running a page does not render them again.
+"""
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+# Below this many uncached codes, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 16
+CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def generate_tray_serials(count, existing=()):
+    """count distinct 8-character serials, none of them in existing"""
+    taken = set(existing)
+    serials = []
+    while len(serials) < count:
+        serial = str(uuid.uuid4())[:8].upper()
+        if serial not in taken:
+            taken.add(serial)
+            serials.append(serial)
+    return serials
+
+
+def label_payload(data):
+    """Text encoded in a tray's QR code
+
+    A 'layout' entry (ReagentOptimizer.encode_layout base45 text) adds a
+    line from which decode_layout() rebuilds the tray's configuration.
+    """
+    payload = (
+        f"KETOS Fluid Tray\n"
+        f"------------------\n"
+        f"Tray ID: {data['tray_serial']}\n"
+        f"Customer: {data['name']}\n"
+        f"Location: {data['unit']}\n"
+        f"Created: {data['date']}\n"
+        f"Operator: {data['operator']}\n"
+        f"Status: Active"
+    )
+    if data.get("layout"):
+        payload += f"\nLayout: {data['layout']}"
+    return payload
+
+
+def _render_png(payload, box_size, border):
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffered = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def render_qr(payload, box_size=10, border=4):
+    """PNG bytes of the QR code for payload"""
+    return render_batch([payload], box_size, border, workers=1)[0]
+
+
+def render_batch(payloads, box_size=10, border=4, workers=None):
+    """PNG bytes for each payload, rendering the uncached ones in parallel"""
+    found = {}
+    with _cache_lock:
+        for payload in dict.fromkeys(payloads):
+            key = (payload, box_size, border)
+            if key in _cache:
+                _cache.move_to_end(key)
+                found[payload] = _cache[key]
+    missing = [p for p in dict.fromkeys(payloads) if p not in found]
+
+    if missing:
+        if len(missing) >= PARALLEL_THRESHOLD and workers != 1:
+            workers = workers or min(len(missing) // PARALLEL_THRESHOLD + 1, os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rendered = list(executor.map(
+                    _render_png, missing, repeat(box_size), repeat(border),
+                    chunksize=max(1, len(missing) // (workers * 4)),
+                ))
+        else:
+            rendered = [_render_png(p, box_size, border) for p in missing]
+        found.update(zip(missing, rendered))
+        with _cache_lock:
+            for payload, png in zip(missing, rendered):
+                _cache[(payload, box_size, border)] = png
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return [found[payload] for payload in payloads]
+
+
+def label_sheet(images, captions, columns=4, format="PNG", margin=20):
+    """Lay QR images out in a grid with a caption under each, as PNG or PDF bytes"""
+    if not images:
+        raise ValueError("No labels to lay out")
+    if format not in ("PNG", "PDF"):
+        raise ValueError(f"Unsupported label sheet format: {format}")
+
+    codes = [Image.open(io.BytesIO(png)).convert("RGB") for png in images]
+    font = ImageFont.load_default()
+    caption_height = 24
+    cell_w = max(code.width for code in codes) + margin
+    cell_h = max(code.height for code in codes) + caption_height + margin
+    columns = max(1, min(columns, len(codes)))
+    rows = (len(codes) + columns - 1) // columns
+
+    sheet = Image.new("RGB", (columns * cell_w + margin, rows * cell_h + margin), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (code, caption) in enumerate(zip(codes, captions)):
+        x = margin + (i % columns) * cell_w
+        y = margin + (i // columns) * cell_h
+        sheet.paste(code, (x, y))
+        text_w = draw.textlength(caption, font=font)
+        draw.text((x + (code.width - text_w) / 2, y + code.height + 4), caption, fill="black", font=font)
+
+    buffered = io.BytesIO()
+    sheet.save(buffered, format=format, **({"resolution": 150.0} if format == "PDF" else {}))
+    return buffered.getvalue()
+
+
+def batch_labels(records, columns=4, box_size=10, workers=None):
+    """QR payloads, PNG codes and one printable PNG sheet for a list of tray records
+
+    Each record carries the label_payload() fields: tray_serial, name, unit,
+    date and operator.
+    """
+    payloads = [label_payload(record) for record in records]
+    images = render_batch(payloads, box_size=box_size, workers=workers)
+    captions = [f"{record['tray_serial']}  {record['name']}" for record in records]
+    return {
+        "serials": [record["tray_serial"] for record in records],
+        "payloads": payloads,
+        "images": images,
+        "captions": captions,
+        "sheet": label_sheet(images, captions, columns=columns),
+    }
@@ -1,11 +1,932 @@
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from datetime import datetime
 from typing import Dict, List, Optional, Union
-from itertools import combinations
+import base64
+import contextvars
+import copy
+import hashlib
+import heapq
+import itertools
 import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+REAGENT_COLORS = {
+    'gray': ['KR1E', 'KR1S', 'KR2S', 'KR3E', 'KR3S', 'KR4E', 'KR4S', 'KR5E', 'KR5S', 'KR6E1', 'KR6E2', 'KR6E3', 'KR13E1', 'KR13S', 'KR14E', 'KR14S', 'KR15E', 'KR15S'],
+    'violet': ['KR7E1', 'KR7E2', 'KR8E1', 'KR8E2', 'KR19E1', 'KR19E2', 'KR19E3', 'KR20E', 'KR36E1', 'KR36E2', 'KR40E1', 'KR40E2'],
+    'green': ['KR9E1', 'KR9E2', 'KR17E1', 'KR17E2', 'KR17E3', 'KR28E1', 'KR28E2', 'KR28E3'],
+    'orange': ['KR10E1', 'KR10E2', 'KR10E3', 'KR12E1', 'KR12E2', 'KR12E3', 'KR18E1', 'KR18E2', 'KR22E1', 'KR27E1', 'KR27E2', 'KR42E1', 'KR42E2'],
+    'white': ['KR11E', 'KR21E1'],
+    'blue': ['KR16E1', 'KR16E2', 'KR16E3', 'KR16E4', 'KR30E1', 'KR30E2', 'KR30E3', 'KR31E1', 'KR31E2', 'KR34E1', 'KR34E2'],
+    'red': ['KR29E1', 'KR29E2', 'KR29E3'],
+    'yellow': ['KR35E1', 'KR35E2']
+}
+
+
+def _match_color(reagent_code, colors):
+    for color, reagents in colors.items():
+        if any(reagent_code.startswith(r) for r in reagents):
+            return color
+    return 'lightgray'
+
+
+class CatalogReagent:
+    """One reagent of one experiment in a compiled ReagentCatalog"""
+
+    __slots__ = ("code", "experiment_id", "volume", "color", "index")
+
+    def __init__(self, code, experiment_id, volume, color, index):
+        self.code = code
+        self.experiment_id = experiment_id
+        self.volume = volume
+        self.color = color
+        self.index = index
+
+    def __repr__(self):
+        return f"CatalogReagent({self.code!r}, experiment_id={self.experiment_id}, volume={self.volume})"
+
+
+class ReagentCatalog:
+    """Indexed view of experiment_data with constant-time reagent lookups
+
+    Reagents are numbered in experiment order, largest volume first within
+    each experiment; that index is the row used by the optimizer's tables.
+    """
+
+    __slots__ = ("reagents", "experiment_names", "experiment_reagents", "_by_code",
+                 "_by_experiment_code", "_colors", "_color_rules")
+
+    def __init__(self, experiment_data, colors=REAGENT_COLORS):
+        self.reagents = []
+        self.experiment_names = {}
+        self.experiment_reagents = {}
+        self._by_code = {}
+        self._by_experiment_code = {}
+        self._color_rules = colors
+        self._colors = {
+            sys.intern(code): _match_color(code, colors)
+            for codes in colors.values() for code in codes
+        }
+
+        for exp_id, exp_data in experiment_data.items():
+            self.experiment_names[exp_id] = exp_data["name"]
+            ids = []
+            for reagent in sorted(exp_data["reagents"], key=lambda r: r["vol"], reverse=True):
+                code = sys.intern(reagent["code"])
+                if code not in self._colors:
+                    self._colors[code] = _match_color(code, colors)
+                record = CatalogReagent(code, exp_id, reagent["vol"], self._colors[code], len(self.reagents))
+                self.reagents.append(record)
+                ids.append(record.index)
+                # A code shared by several experiments resolves to its first experiment
+                self._by_code.setdefault(code, record)
+                self._by_experiment_code[(exp_id, code)] = record
+            self.experiment_reagents[exp_id] = tuple(ids)
+
+    def reagent(self, reagent_code, experiment_id=None):
+        """Look up a reagent by code, optionally within a given experiment"""
+        if experiment_id is None:
+            return self._by_code.get(reagent_code)
+        return self._by_experiment_code.get((experiment_id, reagent_code))
+
+    def max_volume(self, experiment_id):
+        """Largest reagent volume of an experiment"""
+        return self.reagents[self.experiment_reagents[experiment_id][0]].volume
+
+    def experiment_codes(self, experiment_id):
+        """Set of reagent codes an experiment needs"""
+        return {self.reagents[i].code for i in self.experiment_reagents[experiment_id]}
+
+    def color(self, reagent_code):
+        """Display colour of a reagent code"""
+        color = self._colors.get(reagent_code)
+        if color is None:
+            color = self._colors[reagent_code] = _match_color(reagent_code, self._color_rules)
+        return color
+
+    def __len__(self):
+        return len(self.reagents)
+
+    def __repr__(self):
+        return f"ReagentCatalog(experiments={len(self.experiment_names)}, reagents={len(self.reagents)})"
+
+
+class TrayConfiguration:
+    """Compact tray layout backed by parallel per-slot arrays
+
+    Slots hold a catalog reagent index, its experiment id, the tests it
+    provides and which of the experiment's sets it belongs to (-1 when
+    empty). Per-experiment totals are derived on demand. to_dict() rebuilds
+    the nested configuration returned by optimize_tray_configuration.
+    """
+
+    __slots__ = ("catalog", "capacities", "daily_counts", "reagents", "experiments", "tests",
+                 "sets", "order", "info", "_totals")
+
+    EMPTY = -1
+
+    def __init__(self, catalog, capacities, daily_counts):
+        num_slots = len(capacities)
+        self.catalog = catalog
+        self.capacities = capacities
+        self.daily_counts = daily_counts
+        self.reagents = array('h', [self.EMPTY]) * num_slots
+        self.experiments = array('h', [self.EMPTY]) * num_slots
+        self.tests = array('l', [0]) * num_slots
+        self.sets = array('h', [self.EMPTY]) * num_slots
+        self.order = []
+        self.info = {}
+        self._totals = None
+
+    @classmethod
+    def from_dict(cls, config, catalog, capacities):
+        """Build a compact tray from a nested configuration"""
+        tray = cls(catalog, capacities, config["daily_counts"])
+        set_numbers = {}
+        for exp_num, result in config.get("results", {}).items():
+            tray.order.append(exp_num)
+            for set_number, reagent_set in enumerate(result["sets"]):
+                for placement in reagent_set["locations"]:
+                    set_numbers[placement["location"]] = set_number
+        for loc, slot in enumerate(config["tray_locations"]):
+            if slot:
+                reagent = catalog.reagent(slot["reagent_code"], slot["experiment"])
+                if reagent is None:
+                    raise ValueError(f"Unknown reagent {slot['reagent_code']} at location {loc + 1}")
+                tray.place(loc, reagent.index, slot["tests_possible"], set_numbers.get(loc, 0))
+        tray.info = {
+            key: value for key, value in config.items()
+            if key not in ("tray_locations", "results", "daily_counts", "available_locations",
+                           "overall_days_of_operation")
+        }
+        return tray
+
+    def place(self, location, reagent_index, tests, set_number):
+        """Put a reagent in a slot"""
+        experiment = self.catalog.reagents[reagent_index].experiment_id
+        self.reagents[location] = reagent_index
+        self.experiments[location] = experiment
+        self.tests[location] = tests
+        self.sets[location] = set_number
+        if experiment not in self.order:
+            self.order.append(experiment)
+        self._totals = None
+
+    def clear(self, location):
+        """Empty a slot"""
+        self.reagents[location] = self.EMPTY
+        self.experiments[location] = self.EMPTY
+        self.tests[location] = 0
+        self.sets[location] = self.EMPTY
+        self._totals = None
+
+    def available_locations(self):
+        return [loc for loc, reagent in enumerate(self.reagents) if reagent == self.EMPTY]
+
+    def experiment_tests(self, exp_num):
+        """Total tests for an experiment: its weakest reagent summed over all its slots"""
+        if self._totals is None:
+            reagent_tests = defaultdict(int)
+            for reagent, tests in zip(self.reagents, self.tests):
+                if reagent != self.EMPTY:
+                    reagent_tests[reagent] += tests
+            totals = {}
+            for exp in self.order:
+                ids = self.catalog.experiment_reagents[exp]
+                totals[exp] = min(reagent_tests.get(i, 0) for i in ids)
+            self._totals = totals
+        return self._totals.get(exp_num, 0)
+
+    def days_of_operation(self, exp_num):
+        return self.experiment_tests(exp_num) / self.daily_counts[exp_num]
+
+    @property
+    def overall_days_of_operation(self):
+        return min((self.days_of_operation(exp) for exp in self.order), default=0)
+
+    def to_dict(self):
+        """Rebuild the nested configuration structure"""
+        tray_locations = []
+        experiment_sets = {exp: defaultdict(list) for exp in self.order}
+        for loc, reagent_index in enumerate(self.reagents):
+            if reagent_index == self.EMPTY:
+                tray_locations.append(None)
+                continue
+            reagent = self.catalog.reagents[reagent_index]
+            tray_locations.append({
+                "reagent_code": reagent.code,
+                "experiment": reagent.experiment_id,
+                "tests_possible": self.tests[loc],
+                "volume_per_test": reagent.volume,
+                "capacity": self.capacities[loc]
+            })
+            experiment_sets[reagent.experiment_id][self.sets[loc]].append((reagent_index, loc))
+
+        results = {}
+        for exp in self.order:
+            sets = []
+            for set_number in sorted(experiment_sets[exp]):
+                placements = [
+                    {"location": loc, "tests": self.tests[loc], "reagent": self.catalog.reagents[i].code}
+                    for i, loc in sorted(experiment_sets[exp][set_number])
+                ]
+                sets.append({
+                    "locations": placements,
+                    "tests_per_set": min(p["tests"] for p in placements)
+                })
+            results[exp] = {
+                "name": self.catalog.experiment_names[exp],
+                "total_tests": self.experiment_tests(exp),
+                "daily_count": self.daily_counts[exp],
+                "days_of_operation": self.days_of_operation(exp),
+                "sets": sets
+            }
+
+        config = {
+            "tray_locations": tray_locations,
+            "results": results,
+            "daily_counts": self.daily_counts,
+            "available_locations": self.available_locations(),
+            "overall_days_of_operation": self.overall_days_of_operation
+        }
+        config.update(self.info)
+        return config
+
+    def __repr__(self):
+        used = len(self.reagents) - self.reagents.count(self.EMPTY)
+        return f"TrayConfiguration(slots={len(self.reagents)}, used={used}, experiments={self.order})"
+
+
+def _config_to_json(config):
+    return json.dumps(config, separators=(",", ":"))
+
+
+def _config_from_json(data):
+    """Decode a stored configuration, restoring the integer experiment keys"""
+    return restore_experiment_keys(json.loads(data))
+
+
+def restore_experiment_keys(config):
+    """Turn the string experiment keys of a JSON-decoded configuration back into ints"""
+    for key in ("results", "daily_counts"):
+        if key in config:
+            config[key] = {int(exp): value for exp, value in config[key].items()}
+    return config
+
+
+# Binary tray layout, version 1 (integers are big-endian, varints are LEB128):
+#   version:1  tag:2  num_slots:1  flags:1
+#   num_slots bytes of catalog reagent index + 1 (0 = empty slot)
+#   set number of each filled slot, two per byte (one per byte with FLAG_WIDE_SETS)
+#   varint experiment count, then varint experiment id and daily count for each
+#   with FLAG_EXPLICIT_TESTS, varint tests of each filled slot
+#   crc32:4 of everything before it
+# tag is the low 16 bits of a CRC of catalog_version(), so layouts are only
+# decoded against the catalog and tray they were encoded for.
+LAYOUT_VERSION = 1
+_LAYOUT_FLAG_EXPLICIT_TESTS = 1
+_LAYOUT_FLAG_WIDE_SETS = 2
+_BASE45_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+
+
+def _b45encode(data):
+    """RFC 9285 base45, the alphanumeric mode alphabet of QR codes"""
+    chars = []
+    for i in range(0, len(data), 2):
+        if i + 1 < len(data):
+            n = data[i] * 256 + data[i + 1]
+            digits = 3
+        else:
+            n = data[i]
+            digits = 2
+        for _ in range(digits):
+            n, d = divmod(n, 45)
+            chars.append(_BASE45_ALPHABET[d])
+    return "".join(chars)
+
+
+def _b45decode(text):
+    try:
+        values = [_BASE45_ALPHABET.index(c) for c in text]
+    except ValueError:
+        raise ValueError("Invalid base45 layout code")
+    if len(values) % 3 == 1:
+        raise ValueError("Invalid base45 layout code length")
+    data = bytearray()
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        n = sum(v * 45 ** k for k, v in enumerate(chunk))
+        if len(chunk) == 3:
+            if n > 0xFFFF:
+                raise ValueError("Invalid base45 layout code")
+            data += n.to_bytes(2, "big")
+        else:
+            if n > 0xFF:
+                raise ValueError("Invalid base45 layout code")
+            data.append(n)
+    return bytes(data)
+
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated layout code")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _order_int(value):
+    # int() would quietly truncate 1.5 and accept True
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not an integer: {value!r}")
+    return int(value)
+
+
+def normalize_order(order):
+    """Return (experiments, daily_counts) with integer ids, as read from JSON or CSV"""
+    if not isinstance(order, dict):
+        raise ValueError("Invalid order: expected an object with experiments and daily_counts")
+    if not isinstance(order.get("experiments"), (list, tuple)):
+        raise ValueError("Invalid order: experiments must be a list of experiment ids")
+    if not isinstance(order.get("daily_counts"), dict):
+        raise ValueError("Invalid order: daily_counts must map experiment ids to counts")
+    try:
+        experiments = [_order_int(exp) for exp in order["experiments"]]
+        daily_counts = {_order_int(exp): _order_int(count) for exp, count in order["daily_counts"].items()}
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid order: {e}")
+    if not experiments:
+        raise ValueError("Invalid order: no experiments selected")
+    return experiments, daily_counts
+
+
+def solve_order(optimizer, experiments, daily_counts, method="greedy", deadline_ms=None):
+    """Return (configuration, None), or (None, error message) if the order is invalid"""
+    try:
+        config = optimizer.optimize_tray_configuration(
+            experiments, daily_counts, method=method, deadline_ms=deadline_ms
+        )
+        return config, None
+    except ValueError as e:
+        return None, str(e)
+
+
+_pool_optimizer = None
+_pool_run = None
+
+
+def init_worker(optimizer, run=None):
+    """Process pool initializer: the optimizer solve_orders() uses in this worker
+
+    run is the shared portfolio run id; a strategy gives up once it changes.
+    """
+    global _pool_optimizer, _pool_run
+    _pool_optimizer = optimizer
+    _pool_run = run
+
+
+def solve_orders(jobs, method="greedy", deadline_ms=None):
+    """solve_order() for each (experiments, daily_counts) job, in a worker set up by init_worker()"""
+    return [solve_order(_pool_optimizer, experiments, daily_counts, method, deadline_ms)
+            for experiments, daily_counts in jobs]
+
+
+def _run_strategy_in_pool(run_id, strategy, experiments, daily_counts, deadline_ms):
+    token = _active_stop.set(lambda: _pool_run.value != run_id)
+    try:
+        return _pool_optimizer._run_strategy(strategy, experiments, daily_counts, deadline_ms)
+    finally:
+        _active_stop.reset(token)
+
+
+class _UsageGrid:
+    """Slot usages (counts per capacity class) of one tray packed into ints
+
+    Each class gets a bit field that starts biased so that its top bit is set
+    exactly when the class is overdrawn: adding a usage is one integer
+    addition and checking the sum still fits is one mask (code & overflow).
+    """
+
+    __slots__ = ("class_counts", "empty", "overflow", "_shifts", "_widths")
+
+    def __init__(self, class_counts):
+        self.class_counts = tuple(class_counts)
+        self._widths = [count.bit_length() + 1 for count in self.class_counts]
+        self._shifts = [sum(self._widths[:c]) for c in range(len(self._widths))]
+        self.overflow = sum(1 << (s + w - 1) for s, w in zip(self._shifts, self._widths))
+        self.empty = sum(
+            ((1 << (w - 1)) - 1 - count) << s
+            for count, s, w in zip(self.class_counts, self._shifts, self._widths)
+        )
+
+    def offset(self, usage):
+        """Amount to add to a packed usage to take usage more slots"""
+        return sum(n << s for n, s in zip(usage, self._shifts))
+
+    def unpack(self, code):
+        return tuple(
+            ((code >> s) & ((1 << w) - 1)) - ((1 << (w - 1)) - 1 - count)
+            for count, s, w in zip(self.class_counts, self._shifts, self._widths)
+        )
+
+    def unpack_all(self, codes):
+        """unpack() for a list of codes, as a numpy array with a row per code"""
+        import numpy as np
+
+        if sum(self._widths) >= 63:
+            return np.array([self.unpack(code) for code in codes])
+        packed = np.array(codes, dtype=np.int64)
+        return np.stack([
+            ((packed >> s) & ((1 << w) - 1)) - ((1 << (w - 1)) - 1 - count)
+            for count, s, w in zip(self.class_counts, self._shifts, self._widths)
+        ], axis=-1)
+
+    def minimal(self, codes):
+        """codes that no other code undercuts in every class, fewest slots first"""
+        usages = self.unpack_all(codes)
+        undercut = self.undercut(dict.fromkeys(codes, 0), usages)
+        totals = usages.sum(axis=1).tolist() if len(codes) else []
+        kept = [(total, code) for total, code in zip(totals, codes) if code not in undercut]
+        return [code for _, code in sorted(kept, key=lambda item: item[0])]
+
+    def undercut(self, values, usages=None):
+        """Packed usages in values (code -> value) that another usage matches
+        or beats in value with no more slots of any class
+
+        Fills the box of usages spanned by values and takes running maxima
+        along each class, instead of comparing usage pairs, unless the box
+        holds more cells than there are pairs.
+        """
+        import numpy as np
+
+        codes = list(values)
+        if not codes:
+            return set()
+        if usages is None:
+            usages = self.unpack_all(codes)
+        scores = np.array([values[code] for code in codes], dtype=float)
+        low = usages.min(axis=0)
+        shape = tuple(int(n) for n in usages.max(axis=0) - low + 1)
+        if math.prod(shape) > len(codes) ** 2:
+            return {
+                code for code, usage, score in zip(codes, usages, scores)
+                if any(
+                    other_score >= score and (other <= usage).all() and (other != usage).any()
+                    for other, other_score in zip(usages, scores)
+                )
+            }
+
+        cells = tuple((usages - low).T)
+        best = np.full(shape, -np.inf)
+        best[cells] = scores
+        for axis in range(len(shape)):
+            np.maximum.accumulate(best, axis=axis, out=best)
+        # Best value strictly below each cell: one step down in some class
+        below = np.full(shape, -np.inf)
+        for axis in range(len(shape)):
+            lower = tuple(slice(None, -1) if a == axis else slice(None) for a in range(len(shape)))
+            upper = tuple(slice(1, None) if a == axis else slice(None) for a in range(len(shape)))
+            np.maximum(below[upper], best[lower], out=below[upper])
+        return {code for code, hit in zip(codes, below[cells] >= scores) if hit}
+
+
+class _TestLedger:
+    """Running per-reagent test totals and a min-heap of days for placed experiments"""
+
+    __slots__ = ("daily_counts", "required", "reagent_tests", "days", "_heap")
+
+    def __init__(self, catalog, daily_counts):
+        self.daily_counts = daily_counts
+        self.required = {
+            exp: len(catalog.experiment_reagents[exp]) for exp in daily_counts
+            if exp in catalog.experiment_reagents
+        }
+        self.reagent_tests = defaultdict(dict)
+        self.days = {}
+        self._heap = []
+
+    def add_set(self, exp_num, placements):
+        """Record a placed set given as (catalog reagent index, tests) pairs"""
+        totals = self.reagent_tests[exp_num]
+        for index, tests in placements:
+            totals[index] = totals.get(index, 0) + tests
+        days = self.tests(exp_num) / self.daily_counts[exp_num]
+        self.days[exp_num] = days
+        heapq.heappush(self._heap, (days, exp_num))
+
+    def tests(self, exp_num):
+        """Total tests for an experiment, 0 until all of its reagents are placed"""
+        totals = self.reagent_tests.get(exp_num)
+        if not totals or len(totals) < self.required[exp_num]:
+            return 0
+        return min(totals.values())
+
+    def min_days(self):
+        """Days of operation of the limiting placed experiment"""
+        heap = self._heap
+        # Days only grow as sets are added, so superseded entries are discarded lazily
+        while heap and heap[0][0] != self.days[heap[0][1]]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else float('inf')
+
+
+class _LocalSearch:
+    """Incremental local search state over a TrayConfiguration
+
+    Per-reagent and per-experiment totals are kept up to date, so a candidate
+    move is scored from the slots it changes alone. A score is the lowest few
+    experiment days in ascending order, compared lexicographically, so lifting
+    one of several tied limiting experiments still counts as progress.
+    Every move keeps each experiment's reagents in complete sets.
+    """
+
+    DEPTH = 3
+
+    def __init__(self, tray, table, location_class):
+        self.tray = tray
+        self.table = table
+        self.location_class = location_class
+        self.num_classes = max(location_class) + 1
+        self.experiment_reagents = tray.catalog.experiment_reagents
+        self.reagent_experiment = [r.experiment_id for r in tray.catalog.reagents]
+        self.moves = Counter()
+        self._load()
+
+    def _load(self):
+        """Recompute every total from the tray, with tests taken from the table"""
+        tray = self.tray
+        self.reagent_tests = Counter()
+        for loc, reagent in enumerate(tray.reagents):
+            if reagent != TrayConfiguration.EMPTY:
+                tray.tests[loc] = self._slot_tests(reagent, loc)
+                self.reagent_tests[reagent] += tray.tests[loc]
+        tray._totals = None
+        self.experiment_tests = {exp: self._experiment_total(exp, {}) for exp in tray.order}
+        self._rank()
+
+    def _slot_tests(self, reagent, location):
+        return self.table[reagent * self.num_classes + self.location_class[location]]
+
+    def _experiment_total(self, exp_num, delta):
+        return min(self.reagent_tests[r] + delta.get(r, 0) for r in self.experiment_reagents[exp_num])
+
+    def _rank(self):
+        daily_counts = self.tray.daily_counts
+        self.ranking = sorted(
+            (tests / daily_counts[exp], exp) for exp, tests in self.experiment_tests.items()
+        )
+        self.score = tuple(days for days, _ in self.ranking[:self.DEPTH])
+
+    def evaluate(self, changes):
+        """Score of the tray after changes, a sequence of (location, reagent, set_number)"""
+        tray = self.tray
+        delta = defaultdict(int)
+        for loc, reagent, _ in changes:
+            old = tray.reagents[loc]
+            if old != TrayConfiguration.EMPTY:
+                delta[old] -= tray.tests[loc]
+            if reagent != TrayConfiguration.EMPTY:
+                delta[reagent] += self._slot_tests(reagent, loc)
+
+        affected = {self.reagent_experiment[r] for r in delta}
+        days = [self._experiment_total(exp, delta) / tray.daily_counts[exp] for exp in affected]
+        for day, exp in self.ranking:
+            if len(days) >= len(affected) + self.DEPTH:
+                break
+            if exp not in affected:
+                days.append(day)
+        return tuple(sorted(days)[:self.DEPTH])
+
+    def apply(self, kind, changes):
+        tray = self.tray
+        for loc, _, _ in changes:
+            old = tray.reagents[loc]
+            if old != TrayConfiguration.EMPTY:
+                self.reagent_tests[old] -= tray.tests[loc]
+        affected = set()
+        for loc, reagent, set_number in changes:
+            old = tray.reagents[loc]
+            if old != TrayConfiguration.EMPTY:
+                affected.add(self.reagent_experiment[old])
+            if reagent == TrayConfiguration.EMPTY:
+                tray.clear(loc)
+            else:
+                tests = self._slot_tests(reagent, loc)
+                tray.place(loc, reagent, tests, set_number)
+                self.reagent_tests[reagent] += tests
+                affected.add(self.reagent_experiment[reagent])
+        for exp in affected:
+            self.experiment_tests[exp] = self._experiment_total(exp, {})
+        self._rank()
+        self.moves[kind] += 1
+
+    def neighbours(self):
+        """Yield (kind, changes) for every swap, move and set reassignment"""
+        tray = self.tray
+        empty_slot = TrayConfiguration.EMPTY
+        reagents, sets, classes = tray.reagents, tray.sets, self.location_class
+        occupied = [loc for loc, r in enumerate(reagents) if r != empty_slot]
+        empty = [loc for loc, r in enumerate(reagents) if r == empty_slot]
+
+        # Slots of equal capacity are interchangeable, so only cross-class changes matter
+        for i, a in enumerate(occupied):
+            for b in occupied[i + 1:]:
+                if classes[a] != classes[b] and reagents[a] != reagents[b]:
+                    yield "swap", ((a, reagents[b], sets[b]), (b, reagents[a], sets[a]))
+            for b in empty:
+                if classes[a] != classes[b]:
+                    yield "move", ((a, empty_slot, empty_slot), (b, reagents[a], sets[a]))
+
+        # Reassign: free one set of an experiment that has several (or use empty
+        # slots alone) and give the space to a new set of another experiment
+        set_slots = defaultdict(list)
+        for loc in occupied:
+            set_slots[(tray.experiments[loc], sets[loc])].append(loc)
+        set_counts = Counter(exp for exp, _ in set_slots)
+        next_set = {exp: 0 for exp in tray.order}
+        for exp, set_number in set_slots:
+            next_set[exp] = max(next_set[exp], set_number + 1)
+
+        donors = [(None, [])] + [
+            (exp, slots) for (exp, _), slots in set_slots.items() if set_counts[exp] > 1
+        ]
+        for donor, slots in donors:
+            free = sorted(slots + empty, key=lambda loc: (classes[loc], loc))
+            for exp in tray.order:
+                ids = self.experiment_reagents[exp]
+                if exp == donor or len(ids) > len(free):
+                    continue
+                chosen = free[:len(ids)]
+                changes = [(loc, r, next_set[exp]) for loc, r in zip(chosen, ids)]
+                changes += [(loc, empty_slot, empty_slot) for loc in slots if loc not in chosen]
+                yield "reassign", tuple(changes)
+
+    def climb(self, max_iterations, stopped=None):
+        """Best-improvement hill climbing; returns (iterations, converged)
+
+        Gives up early, unconverged, once stopped() turns true.
+        """
+        for iteration in range(max_iterations):
+            if stopped is not None and stopped():
+                return iteration, False
+            best, best_score = None, self.score
+            for kind, changes in self.neighbours():
+                score = self.evaluate(changes)
+                if score > best_score:
+                    best, best_score = (kind, changes), score
+            if best is None:
+                return iteration, True
+            self.apply(*best)
+        return max_iterations, False
+
+    def anneal(self, max_iterations, rng, temperature):
+        """Simulated annealing with linear cooling, finishing on the best tray seen"""
+        best_score, best_state = self.score, self._snapshot()
+        scale = temperature * max(self.score[0] if self.score else 0, 1e-9)
+        candidates = list(self.neighbours())
+        for iteration in range(max_iterations):
+            if not candidates:
+                break
+            kind, changes = rng.choice(candidates)
+            score = self.evaluate(changes)
+            if score < self.score:
+                # Judge a worse move by its first changed entry in the score
+                loss = next(old - new for old, new in zip(self.score, score) if old != new)
+                heat = scale * (1 - iteration / max_iterations)
+                if heat <= 0 or rng.random() >= math.exp(-loss / heat):
+                    continue
+            self.apply(kind, changes)
+            candidates = list(self.neighbours())
+            if self.score > best_score:
+                best_score, best_state = self.score, self._snapshot()
+        self._restore(best_state)
+        return max_iterations
+
+    def _snapshot(self):
+        tray = self.tray
+        return (array('h', tray.reagents), array('h', tray.experiments),
+                array('l', tray.tests), array('h', tray.sets))
+
+    def _restore(self, state):
+        tray = self.tray
+        tray.reagents, tray.experiments, tray.tests, tray.sets = (array(a.typecode, a) for a in state)
+        self._load()
+
+
+class SearchStats:
+    """Phase timings and search counters gathered while one order is optimized"""
+
+    __slots__ = ("method", "timings_ms", "counters", "_start", "_mark")
+
+    def __init__(self, method):
+        self.method = method
+        self.timings_ms = {}
+        self.counters = Counter()
+        self._start = self._mark = time.perf_counter()
+
+    def lap(self, phase):
+        """Charge the time since the previous lap to phase"""
+        now = time.perf_counter()
+        self.timings_ms[phase] = self.timings_ms.get(phase, 0) + (now - self._mark) * 1000
+        self._mark = now
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def to_dict(self):
+        return {
+            "method": self.method,
+            "total_ms": round((self._mark - self._start) * 1000, 3),
+            "timings_ms": {phase: round(ms, 3) for phase, ms in self.timings_ms.items()},
+            "counters": dict(self.counters),
+        }
+
+    def __repr__(self):
+        return f"SearchStats(method={self.method!r}, counters={dict(self.counters)})"
+
+
+# Statistics for the optimization running in the current thread, or None when
+# instrumentation is off; hot paths read it once per call, never per candidate
+_active_stats = contextvars.ContextVar("reagent_optimizer_stats", default=None)
+
+# Callable telling a portfolio strategy in the current thread that its run is
+# over, or None; the exact search polls it next to its deadline
+_active_stop = contextvars.ContextVar("reagent_optimizer_stop", default=None)
+
+
+class OptimizationCache:
+    """LRU cache of optimization results with an optional SQLite store on disk"""
+
+    def __init__(self, max_entries=256, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._version = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS configurations "
+                "(key TEXT PRIMARY KEY, config TEXT NOT NULL, version TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(configurations)")]
+            if "version" not in columns:
+                self._db.execute("ALTER TABLE configurations ADD COLUMN version TEXT")
+            self._db.commit()
+
+    def get(self, key):
+        """Return a fresh copy of the cached configuration, or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT config FROM configurations WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    data = row[0]
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _config_from_json(data)
+
+    def put(self, key, config, version=None):
+        """Store a configuration under key
+
+        version is the catalog version the key was computed for. Keys of
+        other versions can never be looked up again, so the first store
+        under a new version deletes their rows from disk; in memory they
+        simply age out of the LRU.
+        """
+        data = _config_to_json(config)
+        with self._lock:
+            self._remember(key, data)
+            if self._db is not None:
+                if version is not None and version != self._version:
+                    self._db.execute("DELETE FROM configurations WHERE version IS NOT ?", (version,))
+                    self._version = version
+                self._db.execute(
+                    "INSERT OR REPLACE INTO configurations (key, config, version) VALUES (?, ?, ?)",
+                    (key, data, version),
+                )
+                self._db.commit()
+
+    def _remember(self, key, data):
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached configuration, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM configurations")
+                self._db.commit()
+
+    def get_stats(self):
+        """Return hit/miss counters and the number of entries held in memory"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def __repr__(self):
+        return f"OptimizationCache(entries={len(self._entries)}, hits={self.hits}, misses={self.misses})"
+
+
+class TrayGeometry:
+    """Slot layout of a reagent tray: the capacity of every slot in mL and an
+    optional grid width used to draw it"""
+
+    __slots__ = ("capacities", "columns")
+
+    def __init__(self, capacities, columns=None):
+        capacities = tuple(capacities)
+        if not capacities:
+            raise ValueError("A tray needs at least one location")
+        if any(cap <= 0 for cap in capacities):
+            raise ValueError("Location capacities must be positive")
+        if columns is not None and columns <= 0:
+            raise ValueError("Grid columns must be positive")
+        self.capacities = capacities
+        self.columns = columns
+
+    @classmethod
+    def from_classes(cls, classes, columns=None):
+        """Build a geometry from (capacity, count) pairs, numbered in the given order"""
+        return cls([cap for cap, count in classes for _ in range(count)], columns)
+
+    @classmethod
+    def default(cls):
+        """The standard 16-position tray: four 270 mL and twelve 140 mL locations"""
+        return cls.from_classes([(270, 4), (140, 12)], columns=4)
+
+    @property
+    def num_slots(self):
+        return len(self.capacities)
+
+    def is_high_capacity(self, location):
+        """Whether a location belongs to the largest capacity class"""
+        return self.capacities[location] == max(self.capacities)
+
+    @property
+    def grid_shape(self):
+        """(rows, columns) of the tray when drawn as a grid"""
+        columns = self.columns or self.num_slots
+        return -(-self.num_slots // columns), columns
+
+    def grid_position(self, location):
+        """(row, column) of a location when the tray is drawn as a grid"""
+        return divmod(location, self.grid_shape[1])
+
+    def __eq__(self, other):
+        return (isinstance(other, TrayGeometry) and self.capacities == other.capacities
+                and self.columns == other.columns)
+
+    def __hash__(self):
+        return hash((self.capacities, self.columns))
+
+    def __repr__(self):
+        classes = Counter(self.capacities)
+        return f"TrayGeometry(slots={self.num_slots}, classes={dict(classes)}, columns={self.columns})"
+
 
 class ReagentOptimizer:
-    def __init__(self):
+    def __init__(self, cache=None, geometry=None, instrument=False, stats_hook=None):
         self.experiment_data = {
             1: {"name": "Copper (II) (LR)", "reagents": [{"code": "KR1E", "vol": 850}, {"code": "KR1S", "vol": 300}]},
             2: {"name": "Lead (II) Cadmium (II)", "reagents": [{"code": "KR1E", "vol": 850}, {"code": "KR2S", "vol": 400}]},
@@ -40,7 +961,73 @@ class ReagentOptimizer:
             40: {"name": "Potassium", "reagents": [{"code": "KR40E1", "vol": 2000}, {"code": "KR40E2", "vol": 1000}]},
             42: {"name": "Aluminum-BB", "reagents": [{"code": "KR42E1", "vol": 1000}, {"code": "KR42E2", "vol": 1000}]}
         }
-        self.MAX_LOCATIONS = 16
+        self.geometry = geometry or TrayGeometry.default()
+        self.MAX_LOCATIONS = self.geometry.num_slots
+        self.cache = cache
+        # With instrumentation on, each configuration carries a "stats" block that is
+        # also passed to stats_hook, or logged at DEBUG level when no hook is given
+        self.instrument = instrument or stats_hook is not None
+        self.stats_hook = stats_hook
+        # optimize_portfolio() worker processes, started on first use and kept
+        self._portfolio = None
+        self._portfolio_lock = threading.Lock()
+        self.rebuild_tables()
+
+    def rebuild_tables(self):
+        """Compile the reagent catalog and precompute tests per fill for every
+        reagent in every capacity class
+
+        Called again automatically by the public methods when experiment_data
+        or the geometry no longer match the compiled tables.
+        """
+        self.MAX_LOCATIONS = self.geometry.num_slots
+        self.catalog = ReagentCatalog(self.experiment_data)
+        self._compiled_data = copy.deepcopy(self.experiment_data)
+        self._compiled_geometry = self.geometry
+        self._capacities = sorted(
+            {self.get_location_capacity(loc) for loc in range(self.MAX_LOCATIONS)}, reverse=True
+        )
+        class_ids = {cap: c for c, cap in enumerate(self._capacities)}
+        self._location_class = [
+            class_ids[self.get_location_capacity(loc)] for loc in range(self.MAX_LOCATIONS)
+        ]
+        self._slot_capacities = tuple(self._capacities[c] for c in self._location_class)
+
+        # Flat table with one row per catalog reagent and one column per
+        # capacity class; _reagent_rows holds each experiment's row offsets in
+        # catalog order (largest volume first), matching placement order.
+        num_classes = len(self._capacities)
+        self._tests_per_fill = array('l', [
+            self.calculate_tests(reagent.volume, cap)
+            for reagent in self.catalog.reagents for cap in self._capacities
+        ])
+        self._reagent_rows = {
+            exp_num: [index * num_classes for index in ids]
+            for exp_num, ids in self.catalog.experiment_reagents.items()
+        }
+
+        # Placement frontiers for one set of each experiment, and the multi-set
+        # options of exact/dp filled in as each (experiment, class counts) is used
+        self._placement_frontier = {
+            exp_num: self._build_placement_frontier(exp_num) for exp_num in self.catalog.experiment_reagents
+        }
+        self._options_cache = {}
+        # Hashed once here, since every cached request needs it in its key
+        self._catalog_version = self._compute_catalog_version()
+
+    def _ensure_tables(self):
+        """Rebuild the compiled tables if experiment_data or the geometry changed since"""
+        if self.geometry is not self._compiled_geometry or self.experiment_data != self._compiled_data:
+            self.rebuild_tables()
+
+    def compact_configuration(self, config):
+        """Convert a configuration dict into a TrayConfiguration"""
+        self._ensure_tables()
+        return TrayConfiguration.from_dict(config, self.catalog, self._slot_capacities)
+
+    def _tests_for(self, row, location):
+        """Tests per fill for the reagent at table row placed in location"""
+        return self._tests_per_fill[row + self._location_class[location]]
    
     def calculate_tests(self, volume_ul, capacity_ml):
         """Calculate number of tests possible for a given volume and capacity"""
@@ -48,101 +1035,788 @@ class ReagentOptimizer:
 
     def get_location_capacity(self, location):
         """Get the capacity of a location in mL"""
-        return 270 if location < 4 else 140
-
-    def _evaluate_reagent_placement(self, reagent, location):
-        """Evaluate tests possible for a single reagent in a location"""
-        capacity = self.get_location_capacity(location)
-        return self.calculate_tests(reagent["vol"], capacity)
-
-    def _evaluate_location_set(self, exp_num, locations, reagents):
-        """Evaluate how many tests a set of locations can provide"""
-        tests_possible = []
-        for reagent, loc in zip(reagents, locations):
-            tests = self._evaluate_reagent_placement(reagent, loc)
-            tests_possible.append(tests)
-        
+        return self.geometry.capacities[location]
+
+    def _score_set(self, exp_num, slot_classes):
+        """Score one set with its reagents (largest volume first) in the given capacity classes"""
+        table = self._tests_per_fill
+
         # Base score is minimum tests possible
-        min_tests = min(tests_possible)
-        
+        min_tests = min([
+            table[row + c] for row, c in zip(self._reagent_rows[exp_num], slot_classes)
+        ])
+
         # Bonus for using high-capacity locations effectively
-        high_cap_usage = len([loc for loc in locations if loc < 4])
-        if high_cap_usage > 0:
+        if 0 in slot_classes:
             min_tests *= 1.1  # 10% bonus for effective high-capacity usage
-            
+
         return min_tests
-    
+
+    def _build_placement_frontier(self, exp_num):
+        """Rank every split of one reagent set over the capacity classes
+
+        Returns (score, split) pairs, best score first and, among equal
+        scores, fewest high-capacity slots first. Splits that need at least
+        as many slots of every class as a better-ranked split are dropped,
+        since the better one fits wherever they do.
+        """
+        num_reagents = len(self._reagent_rows[exp_num])
+        num_classes = len(self._capacities)
+        ranked = []
+        for split in reversed(list(self._slot_distributions(num_reagents, [num_reagents] * num_classes))):
+            slot_classes = [c for c, n in enumerate(split) for _ in range(n)]
+            score = self._score_set(exp_num, slot_classes)
+            if score > 0:
+                ranked.append((score, split))
+        ranked.sort(key=lambda entry: -entry[0])
+
+        frontier = []
+        for score, split in ranked:
+            if not any(all(a <= b for a, b in zip(kept, split)) for _, kept in frontier):
+                frontier.append((score, split))
+        return tuple(frontier)
+
     def _find_best_locations_for_experiment(self, exp_num, available_locations, daily_count):
         """Find optimal locations for an experiment"""
-        exp_data = self.experiment_data[exp_num]
-        reagents = sorted(exp_data["reagents"], key=lambda r: r["vol"], reverse=True)
-        num_reagents = len(reagents)
-        
-        best_locations = None
-        best_tests = 0
+        # Locations with the same capacity are interchangeable, so the best split
+        # of the set over capacity classes is the first frontier entry that fits
+        by_class = [[] for _ in self._capacities]
+        location_class = self._location_class
+        for loc in available_locations:
+            by_class[location_class[loc]].append(loc)
 
-        # Get available high and low capacity locations
-        high_cap_locs = [loc for loc in available_locations if loc < 4]
-        low_cap_locs = [loc for loc in available_locations if loc >= 4]
-        
-        # For high-volume reagents, prioritize high-capacity locations
-        high_volume_reagents = [r for r in reagents if r["vol"] >= 1000]
-        if high_volume_reagents and daily_count > 1:  # Prioritize high daily counts
-            remaining_reagents = [r for r in reagents if r["vol"] < 1000]
-            
-            for num_high in range(min(len(high_cap_locs) + 1, len(high_volume_reagents) + 1)):
-                if num_high + len(remaining_reagents) > len(available_locations):
-                    continue
-                    
-                for high_locs in combinations(high_cap_locs, num_high):
-                    remaining_needed = num_reagents - len(high_locs)
-                    
-                    for low_locs in combinations(low_cap_locs, remaining_needed):
-                        test_locations = list(high_locs) + list(low_locs)
-                        tests = self._evaluate_location_set(exp_num, test_locations, reagents)
-                        
-                        if tests > best_tests:
-                            best_tests = tests
-                            best_locations = test_locations
-
-        # Try all other combinations
-        for num_high in range(min(len(high_cap_locs) + 1, num_reagents + 1)):
-            remaining_needed = num_reagents - num_high
-            if remaining_needed > len(low_cap_locs):
-                continue
-                
-            for high_locs in combinations(high_cap_locs, num_high):
-                for low_locs in combinations(low_cap_locs, remaining_needed):
-                    test_locations = list(high_locs) + list(low_locs)
-                    tests = self._evaluate_location_set(exp_num, test_locations, reagents)
-                    
-                    if tests > best_tests:
-                        best_tests = tests
-                        best_locations = test_locations
-
-        return best_locations, best_tests
-
-    def optimize_tray_configuration(self, selected_experiments, daily_counts):
-        """Optimize tray configuration with enhanced balancing"""
-        # Validate inputs
+        frontier = self._placement_frontier[exp_num]
+        for checked, (score, split) in enumerate(frontier, 1):
+            if all(n <= len(locs) for n, locs in zip(split, by_class)):
+                best_locations = [loc for locs, n in zip(by_class, split) for loc in locs[:n]]
+                break
+        else:
+            checked, score, best_locations = len(frontier), 0, None
+
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("candidates_evaluated", checked)
+        return best_locations, score
+
+    def optimize_tray_configuration(self, selected_experiments, daily_counts, method="greedy",
+                                    node_limit=None, deadline_ms=None):
+        """Optimize tray configuration with enhanced balancing
+
+        method="greedy" is the fast two-phase heuristic. method="exact" runs a
+        branch-and-bound search over reagent set placements and reports the
+        optimality gap of the returned configuration (0 when proven optimal).
+        method="dp" finds the same optimum by binary searching the target days
+        with a dynamic program over capacity-class slot counts.
+
+        If the optimizer was given an OptimizationCache, repeated orders are
+        answered from it; entries are keyed on the catalog version, so editing
+        reagent volumes makes older entries unreachable.
+
+        With deadline_ms the call is bounded in time: the greedy configuration
+        is built first and branch-and-bound then improves on it until the
+        deadline. The best configuration found is returned with
+        "proven_optimal" and a "trajectory" of (elapsed_ms, days, source)
+        improvements. Only proven optima are cached, shared with method="exact";
+        a cached optimum is returned at once with a single "cache" trajectory
+        entry.
+
+        With instrument=True the configuration also holds a "stats" block of
+        per-phase timings (ms) and search counters.
+        """
+        self._validate_order(selected_experiments, daily_counts)
+        if deadline_ms is not None:
+            if method not in ("greedy", "exact"):
+                raise ValueError(f"deadline_ms is not supported with method {method!r}")
+            if deadline_ms <= 0:
+                raise ValueError("deadline_ms must be positive")
+
+        if not self.instrument:
+            return self._optimize_cached(selected_experiments, daily_counts, method, node_limit,
+                                         deadline_ms)
+
+        stats = SearchStats(method)
+        token = _active_stats.set(stats)
+        try:
+            config = self._optimize_cached(selected_experiments, daily_counts, method, node_limit,
+                                           deadline_ms)
+        finally:
+            _active_stats.reset(token)
+        stats.lap("finish")
+        config["stats"] = stats.to_dict()
+        self._report_stats(config["stats"])
+        return config
+
+    def _validate_order(self, selected_experiments, daily_counts):
+        self._ensure_tables()
+        if not selected_experiments:
+            raise ValueError("No experiments selected")
         for exp in selected_experiments:
-            if exp not in self.experiment_data:
+            if exp not in self.catalog.experiment_reagents:
                 raise ValueError(f"Invalid experiment number: {exp}")
             if exp not in daily_counts or daily_counts[exp] <= 0:
                 raise ValueError(f"Invalid daily count for experiment {exp}")
 
-        # Initialize configuration
-        config = {
+    def _optimize_cached(self, selected_experiments, daily_counts, method, node_limit, deadline_ms=None):
+        if deadline_ms is not None:
+            return self._optimize_anytime_cached(selected_experiments, daily_counts, node_limit, deadline_ms)
+        if self.cache is None:
+            return self._optimize(selected_experiments, daily_counts, method, node_limit)
+
+        # Equivalent orders share one entry, so they are always solved in canonical order
+        selected_experiments = sorted(selected_experiments)
+        key = self.cache_key(selected_experiments, daily_counts, method, node_limit)
+        config = self.cache.get(key)
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("cache_hits" if config is not None else "cache_misses")
+            stats.lap("cache_lookup")
+        if config is None:
+            config = self._optimize(selected_experiments, daily_counts, method, node_limit)
+            self.cache.put(key, config, self.catalog_version())
+            if stats is not None:
+                stats.lap("cache_store")
+        return config
+
+    def _optimize_anytime_cached(self, selected_experiments, daily_counts, node_limit, deadline_ms):
+        """Anytime search that answers from, and stores, proven optima in the cache
+
+        A proven optimum does not depend on timing, so it is shared with
+        method="exact" under the exact key; unproven results are never stored.
+        """
+        if self.cache is None:
+            return self._optimize_anytime(selected_experiments, daily_counts, node_limit, deadline_ms)
+
+        start = time.perf_counter()
+        selected_experiments = sorted(selected_experiments)
+        key = self.cache_key(selected_experiments, daily_counts, "exact")
+        config = self.cache.get(key)
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("cache_hits" if config is not None else "cache_misses")
+            stats.lap("cache_lookup")
+        if config is not None and config.get("optimality_gap") == 0:
+            config["proven_optimal"] = True
+            config["trajectory"] = [{
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                "days": config["overall_days_of_operation"],
+                "source": "cache",
+            }]
+            return config
+
+        config = self._optimize_anytime(selected_experiments, daily_counts, node_limit, deadline_ms)
+        if config["proven_optimal"]:
+            stored = {k: v for k, v in config.items() if k not in ("proven_optimal", "trajectory")}
+            self.cache.put(key, stored, self.catalog_version())
+            if stats is not None:
+                stats.lap("cache_store")
+        return config
+
+    def _report_stats(self, stats):
+        if self.stats_hook is not None:
+            self.stats_hook(stats)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "optimized tray with %s in %.2f ms: %s", stats["method"], stats["total_ms"],
+                stats["counters"], extra={"optimizer_stats": stats}
+            )
+
+    def catalog_version(self):
+        """Hash of everything in the catalog and tray that affects optimization results"""
+        self._ensure_tables()
+        return self._catalog_version
+
+    def _compute_catalog_version(self):
+        """Hash of the compiled catalog and tables the solvers read"""
+        catalog = {
+            "experiments": [
+                [exp_num, self.catalog.experiment_names[exp_num],
+                 [[self.catalog.reagents[i].code, self.catalog.reagents[i].volume] for i in ids]]
+                for exp_num, ids in sorted(self.catalog.experiment_reagents.items())
+            ],
+            "capacities": list(self._slot_capacities),
+            "tests_per_fill": list(self._tests_per_fill),
+        }
+        return hashlib.sha256(json.dumps(catalog).encode()).hexdigest()
+
+    def cache_key(self, selected_experiments, daily_counts, method="greedy", node_limit=None):
+        """Canonical cache key for an optimization request"""
+        request = {
+            "catalog": self.catalog_version(),
+            "experiments": sorted(selected_experiments),
+            "daily_counts": [[exp, daily_counts[exp]] for exp in sorted(selected_experiments)],
+            "method": method,
+            "node_limit": node_limit,
+        }
+        return hashlib.sha256(json.dumps(request).encode()).hexdigest()
+
+    def optimize_many(self, orders, workers=None, method="greedy", chunksize=16, window=None,
+                      compact=False, deadline_ms=None):
+        """Optimize a batch of orders, yielding results in input order
+
+        Each order is a dict with "experiments" and "daily_counts". Every result
+        is a dict holding the order, its configuration and an error message
+        (None on success), so an invalid order does not stop the batch.
+        Identical orders are solved once. With more than one worker, distinct
+        orders are sent to a process pool in chunks of `chunksize`; at most
+        `window` orders are held at a time, so orders may be a lazily read
+        stream of any length. With compact=True configurations are returned as
+        TrayConfiguration objects, which take far less memory than dicts.
+        deadline_ms bounds the time spent on each order, as in
+        optimize_tray_configuration.
+        """
+        self._ensure_tables()
+        workers = workers or os.cpu_count() or 1
+        window = window or workers * chunksize * 4
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker, initargs=(self,)
+            )
+
+        # Distinct orders by key; keys still referenced from `pending` are never evicted
+        solved = OrderedDict()
+        waiting = Counter()
+        pending = deque()
+        batch = []
+
+        def flush():
+            jobs = [(experiments, daily_counts) for _, experiments, daily_counts in batch]
+            if executor is not None:
+                future = executor.submit(solve_orders, jobs, method, deadline_ms)
+            else:
+                future = Future()
+                future.set_result([solve_order(self, e, d, method, deadline_ms) for e, d in jobs])
+            for index, (key, _, _) in enumerate(batch):
+                solved[key]["future"] = future
+                solved[key]["index"] = index
+            batch.clear()
+
+        def ready():
+            order, key, error = pending[0]
+            if key is None:
+                return True
+            future = solved[key]["future"]
+            return future is not None and future.done()
+
+        def next_result():
+            order, key, error = pending.popleft()
+            if key is None:
+                return {"order": order, "config": None, "error": error}
+            entry = solved[key]
+            if entry["future"] is None:
+                flush()
+            config, error = entry["future"].result()[entry["index"]]
+            if compact and config is not None:
+                config = self.compact_configuration(config)
+            elif entry["yielded"] and config is not None:
+                config = copy.deepcopy(config)
+            entry["yielded"] = True
+            waiting[key] -= 1
+            while len(solved) > window:
+                oldest = next(iter(solved))
+                if waiting[oldest] > 0:
+                    break
+                del solved[oldest]
+                del waiting[oldest]
+            return {"order": order, "config": config, "error": error}
+
+        try:
+            for order in orders:
+                try:
+                    experiments, daily_counts = normalize_order(order)
+                except ValueError as e:
+                    pending.append((order, None, str(e)))
+                else:
+                    # Solving in canonical order lets equivalent orders share one result
+                    experiments = sorted(experiments)
+                    key = json.dumps([experiments, [daily_counts.get(exp) for exp in experiments]])
+                    if key in solved:
+                        solved.move_to_end(key)
+                    else:
+                        solved[key] = {"future": None, "index": None, "yielded": False}
+                        batch.append((key, experiments, daily_counts))
+                        if len(batch) >= chunksize:
+                            flush()
+                    waiting[key] += 1
+                    pending.append((order, key, None))
+
+                while pending and (len(pending) >= window or ready()):
+                    yield next_result()
+
+            while pending:
+                yield next_result()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def improve_configuration(self, config, max_iterations=1000, anneal=False, seed=None,
+                              temperature=0.05):
+        """Polish a configuration by local search over reagent placements
+
+        Neighbours swap two reagents between capacity classes, move a reagent
+        to an empty slot, or reassign one set of an experiment (or empty
+        slots) to a new set of another. By default the best improving
+        neighbour is taken until none is left or max_iterations is reached.
+        With anneal=True a seeded simulated annealing pass runs first; its
+        temperature is relative to the starting days of operation.
+
+        Accepts a configuration dict or a TrayConfiguration and returns the
+        same kind, with a "local_search" summary. Placements never get worse.
+        """
+        compact = isinstance(config, TrayConfiguration)
+        # Work on a copy so the caller's configuration is left as it was
+        data = config.to_dict() if compact else config
+        if len(data["tray_locations"]) != self.MAX_LOCATIONS:
+            raise ValueError("Configuration does not match the tray geometry")
+        tray = self.compact_configuration(data)
+
+        search = _LocalSearch(tray, self._tests_per_fill, self._location_class)
+        initial_days = tray.overall_days_of_operation
+        iterations = 0
+        if anneal:
+            iterations += search.anneal(max_iterations, random.Random(seed), temperature)
+        climbed, converged = search.climb(max_iterations, _active_stop.get())
+        iterations += climbed
+
+        final_days = tray.overall_days_of_operation
+        gap = tray.info.get("optimality_gap")
+        if gap:
+            tray.info["optimality_gap"] = max(gap - (final_days - initial_days), 0)
+        tray.info["local_search"] = {
+            "initial_days": initial_days,
+            "final_days": final_days,
+            "iterations": iterations,
+            "converged": converged,
+            "moves": dict(search.moves),
+        }
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("local_search_moves", sum(search.moves.values()))
+        return tray if compact else tray.to_dict()
+
+    def optimize_portfolio(self, selected_experiments, daily_counts, workers=None, deadline_ms=None,
+                           restarts=4, seed=0, strategies=None):
+        """Race competing strategies in a process pool and return the best configuration
+
+        The default portfolio runs branch-and-bound ("exact") next to greedy
+        placements with different Phase 1 orderings ("priority", "volume",
+        "frequency" and `restarts` seeded "random:<n>" shuffles), each polished
+        by improve_configuration. Once a proven optimum arrives or deadline_ms
+        passes, strategies that have not started are cancelled and running
+        ones stop at their next search node or local search step. The worker processes are kept
+        for later calls (close() shuts them down) and serve one portfolio at
+        a time. The winning configuration carries a "portfolio" summary with
+        the days each strategy reached (None when it did not finish).
+        """
+        self._validate_order(selected_experiments, daily_counts)
+        if strategies is None:
+            strategies = ["exact", "priority", "volume", "frequency"]
+            strategies += [f"random:{seed + n}" for n in range(restarts)]
+        pool_size = workers or os.cpu_count() or 1
+        workers = min(pool_size, len(strategies))
+        start = time.perf_counter()
+        deadline = start + deadline_ms / 1000 if deadline_ms is not None else None
+
+        outcomes = {strategy: None for strategy in strategies}
+        errors = []
+        best = None
+        proven_days = None
+
+        def finished(strategy, config):
+            nonlocal best, proven_days
+            days = config["overall_days_of_operation"]
+            outcomes[strategy] = days
+            if best is None or days > best[1]["overall_days_of_operation"]:
+                best = (strategy, config)
+            if config.get("proven_optimal"):
+                proven_days = days
+                return True
+            return False
+
+        if workers == 1:
+            # Fast strategies first, so the search has an answer before the exact solver runs
+            for strategy in sorted(strategies, key=lambda s: s == "exact"):
+                remaining = None if deadline is None else (deadline - time.perf_counter()) * 1000
+                if remaining is not None and remaining <= 0 and best is not None:
+                    break
+                try:
+                    config = self._run_strategy(strategy, selected_experiments, daily_counts, remaining)
+                except ValueError as e:
+                    errors.append(str(e))
+                    continue
+                if finished(strategy, config):
+                    break
+        else:
+            with self._portfolio_lock:
+                executor, run = self._portfolio_pool(pool_size)
+                run.value += 1
+                futures = {
+                    executor.submit(_run_strategy_in_pool, run.value, strategy, selected_experiments,
+                                    daily_counts, deadline_ms): strategy
+                    for strategy in strategies
+                }
+                try:
+                    pending = set(futures)
+                    while pending:
+                        timeout = None
+                        if deadline is not None and best is not None:
+                            timeout = max(deadline - time.perf_counter(), 0)
+                        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                        if not done:
+                            break
+                        proven = False
+                        for future in done:
+                            try:
+                                proven |= finished(futures[future], future.result())
+                            except ValueError as e:
+                                errors.append(str(e))
+                        if proven:
+                            break
+                finally:
+                    # Queued strategies never start; running ones see the run id
+                    # change and stop, leaving the pool free for the next call
+                    for future in futures:
+                        future.cancel()
+                    run.value += 1
+
+        if best is None:
+            raise ValueError(errors[0] if errors else "No strategy finished")
+        winner, config = best
+        # A proof from any strategy covers every configuration reaching the same days
+        config["proven_optimal"] = (
+            proven_days is not None and config["overall_days_of_operation"] >= proven_days
+        )
+        if config["proven_optimal"]:
+            config["optimality_gap"] = 0
+        config["portfolio"] = {
+            "winner": winner,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+            "strategies": outcomes,
+        }
+        return config
+
+    def _portfolio_pool(self, workers):
+        """(executor, shared run id) for optimize_portfolio(), started or replaced as needed
+
+        The workers hold a copy of this optimizer, so the pool is replaced when
+        the catalog or the requested worker count changes. Callers hold
+        _portfolio_lock.
+        """
+        version = self.catalog_version()
+        if self._portfolio is not None:
+            executor, run, pool_workers, pool_version = self._portfolio
+            if pool_workers == workers and pool_version == version:
+                return executor, run
+            executor.shutdown(wait=False, cancel_futures=True)
+        run = multiprocessing.RawValue("q", 0)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self, run))
+        self._portfolio = (executor, run, workers, version)
+        return executor, run
+
+    def _run_strategy(self, strategy, selected_experiments, daily_counts, deadline_ms=None):
+        """Solve an order with one portfolio strategy"""
+        if strategy == "exact":
+            if deadline_ms is not None:
+                return self.optimize_tray_configuration(
+                    selected_experiments, daily_counts, method="exact", deadline_ms=max(deadline_ms, 1)
+                )
+            config = self.optimize_tray_configuration(selected_experiments, daily_counts, method="exact")
+            config["proven_optimal"] = config["optimality_gap"] == 0
+            return config
+
+        if strategy == "priority":
+            order = self._prioritize_experiments(selected_experiments, daily_counts)
+        elif strategy == "volume":
+            order = sorted(
+                selected_experiments,
+                key=lambda e: (self.catalog.max_volume(e), daily_counts[e]),
+                reverse=True
+            )
+        elif strategy == "frequency":
+            order = sorted(
+                selected_experiments,
+                key=lambda e: (daily_counts[e], self.catalog.max_volume(e)),
+                reverse=True
+            )
+        elif strategy.startswith("random:"):
+            order = list(selected_experiments)
+            random.Random(int(strategy.split(":", 1)[1])).shuffle(order)
+        else:
+            raise ValueError(f"Unknown portfolio strategy: {strategy}")
+
+        config = self._optimize_greedy(selected_experiments, daily_counts, order=order)
+        return self.improve_configuration(config)
+
+    def sweep(self, experiments, daily_count_grid, method="dp"):
+        """Days of operation over a grid of daily-count vectors, in one call
+
+        daily_count_grid is either a dict mapping each experiment to a
+        sequence of daily counts (every combination is evaluated) or an
+        iterable of daily_counts dicts. A layout fixes the tests of every
+        experiment, so its days at all grid points come from one broadcast
+        division. The optimizer is only re-run at points where the best known
+        layout is not provably optimal: solving at d gives opt(d'), for any
+        d', at most opt(d) / min(d' / d), so points whose bottleneck did not
+        move are covered without solving. method must be "dp" or "exact",
+        since the bounds need true optima.
+
+        Returns a pandas DataFrame with one row per grid point: a
+        daily_count_<exp> column per experiment, overall_days_of_operation,
+        limiting_experiment, the layout index and whether the point was
+        solved. The layouts are in df.attrs["configurations"].
+        """
+        import numpy as np
+        import pandas as pd
+
+        if method not in ("dp", "exact"):
+            raise ValueError(f"sweep needs an optimal method, not {method!r}")
+        experiments = list(experiments)
+        if isinstance(daily_count_grid, dict):
+            axes = []
+            for exp in experiments:
+                values = daily_count_grid.get(exp)
+                if values is None:
+                    raise ValueError(f"No daily counts given for experiment {exp}")
+                # Scalars, sequences and NumPy arrays alike, as plain Python numbers
+                axes.append(np.atleast_1d(values).tolist())
+            points = list(itertools.product(*axes))
+        else:
+            points = [tuple(np.asarray(counts[exp]).item() for exp in experiments) for counts in daily_count_grid]
+        if not points:
+            raise ValueError("Empty daily count grid")
+
+        counts = np.asarray(points, dtype=float)
+        if (counts <= 0).any():
+            raise ValueError("Daily counts must be positive")
+
+        num_points = len(points)
+        lower = np.zeros(num_points)
+        upper = np.full(num_points, np.inf)
+        layout = np.full(num_points, -1)
+        solved = np.zeros(num_points, dtype=bool)
+        configurations = []
+
+        while True:
+            open_points = lower < upper * (1 - 1e-9)
+            if not open_points.any():
+                break
+            # Solve where the best known layout could be furthest from optimal
+            with np.errstate(divide="ignore"):
+                gap = np.where(open_points, upper / lower, -1)
+            g = int(np.argmax(gap))
+            # The bounds use the exact counts, so the solve must as well or the point never closes
+            point_counts = dict(zip(experiments, points[g]))
+            config = self.optimize_tray_configuration(experiments, point_counts, method=method)
+            solved[g] = True
+            days = config["overall_days_of_operation"]
+
+            tests = np.array([config["results"][exp]["total_tests"] for exp in experiments], dtype=float)
+            values = (tests / counts).min(axis=1)
+            better = values > lower
+            lower[better] = values[better]
+            layout[better] = len(configurations)
+            configurations.append(config)
+
+            scale = (counts / counts[g]).min(axis=1)
+            upper = np.minimum(upper, days / scale)
+
+        limiting = np.array([
+            [config["results"][exp]["total_tests"] for exp in experiments] for config in configurations
+        ], dtype=float)[layout] / counts
+
+        whole = (counts == np.round(counts)).all()
+        df = pd.DataFrame(counts.astype(int) if whole else counts, columns=[f"daily_count_{exp}" for exp in experiments])
+        df["overall_days_of_operation"] = lower
+        df["limiting_experiment"] = np.asarray(experiments)[limiting.argmin(axis=1)]
+        df["layout"] = layout
+        df["solved"] = solved
+        df.attrs["configurations"] = configurations
+        return df
+
+    def plan_trays(self, selected_experiments, daily_counts, num_trays=None):
+        """Plan an order over several trays to maximise fleet days of operation
+
+        An experiment may sit on more than one tray; its fleet tests are the
+        sum over those trays, while each reagent set stays on a single tray.
+        Without num_trays, the fewest trays holding one set of every
+        experiment are used. Complementary trays are packed for the highest
+        target days found by binary search and compared with num_trays
+        identical copies of the single-tray optimum when the order fits on one.
+
+        Returns a dict with one configuration per tray under "trays", fleet
+        "results" per experiment and the fleet "overall_days_of_operation".
+        """
+        self._validate_order(selected_experiments, daily_counts)
+        for exp in selected_experiments:
+            if len(self.catalog.experiment_reagents[exp]) > self.MAX_LOCATIONS:
+                raise ValueError(f"Experiment {exp} does not fit on a single tray")
+        if num_trays is not None and num_trays < 1:
+            raise ValueError("num_trays must be at least 1")
+
+        classes = self._capacity_classes()
+        class_counts = tuple(len(locs) for _, locs in classes)
+        options = {
+            exp: sorted(self._experiment_options(exp, class_counts), key=lambda o: (sum(o[1]), -o[0]))
+            for exp in selected_experiments
+        }
+
+        total_reagents = sum(len(self.catalog.experiment_reagents[exp]) for exp in selected_experiments)
+        if num_trays is None:
+            num_trays = -(-total_reagents // self.MAX_LOCATIONS)
+            while self._pack_trays(options, daily_counts, num_trays, class_counts, 0) is None:
+                num_trays += 1
+        packing = self._pack_trays(options, daily_counts, num_trays, class_counts, 0)
+        if packing is None:
+            raise ValueError(f"The selected experiments do not fit on {num_trays} trays")
+
+        # No experiment can beat num_trays copies of its best single-tray option
+        low = 0
+        high = min(num_trays * max(o[0] for o in options[exp]) / daily_counts[exp] for exp in options)
+        for _ in range(60):
+            if high - low <= 1e-9 * max(high, 1):
+                break
+            target = (low + high) / 2
+            packed = self._pack_trays(options, daily_counts, num_trays, class_counts, target)
+            if packed is None:
+                high = target
+            else:
+                low, packing = target, packed
+
+        ledger = _TestLedger(self.catalog, daily_counts)
+        trays = [self._new_configuration(daily_counts) for _ in range(num_trays)]
+        pools = [[list(locs) for _, locs in classes] for _ in range(num_trays)]
+        for tray, exp, dists in packing:
+            self._place_distributions(trays[tray], exp, dists, pools[tray], ledger)
+        self._fill_trays(trays, selected_experiments, daily_counts, ledger)
+        strategy = "complementary"
+
+        if total_reagents <= self.MAX_LOCATIONS:
+            single = self._optimize_dp(selected_experiments, daily_counts)
+            if num_trays * single["overall_days_of_operation"] >= ledger.min_days():
+                trays = [single] + [copy.deepcopy(single) for _ in range(num_trays - 1)]
+                strategy = "identical" if num_trays > 1 else "single"
+                ledger = _TestLedger(self.catalog, daily_counts)
+                for exp, result in single["results"].items():
+                    for reagent_set in result["sets"]:
+                        placements = [
+                            (self.catalog.reagent(p["reagent"], exp).index, p["tests"] * num_trays)
+                            for p in reagent_set["locations"]
+                        ]
+                        ledger.add_set(exp, placements)
+
+        for config in trays:
+            config["daily_counts"] = {exp: daily_counts[exp] for exp in config["results"]}
+            self._calculate_final_results(config)
+
+        results = {}
+        for exp in selected_experiments:
+            total_tests = ledger.tests(exp)
+            results[exp] = {
+                "name": self.catalog.experiment_names[exp],
+                "total_tests": total_tests,
+                "daily_count": daily_counts[exp],
+                "days_of_operation": total_tests / daily_counts[exp],
+                "trays": [t for t, config in enumerate(trays) if exp in config["results"]],
+            }
+        return {
+            "num_trays": num_trays,
+            "strategy": strategy,
+            "trays": trays,
+            "results": results,
+            "daily_counts": daily_counts,
+            "overall_days_of_operation": min(r["days_of_operation"] for r in results.values()),
+        }
+
+    def _pack_trays(self, options, daily_counts, num_trays, class_counts, target):
+        """Assign experiment options to trays so every experiment reaches target days
+
+        Each experiment takes the smallest option that covers its need on one
+        tray, best fit first; only when no single tray can carry it is the need
+        split over the emptiest trays. Returns (tray, exp, distributions)
+        placements, or None when the target cannot be packed.
+        """
+        remaining = [list(class_counts) for _ in range(num_trays)]
+        needs = {exp: target * daily_counts[exp] for exp in options}
+        # Experiments needing the largest share of a whole tray go first
+        order = sorted(options, key=lambda exp: needs[exp] / max(o[0] for o in options[exp]),
+                       reverse=True)
+
+        placements = []
+        for exp in order:
+            need = needs[exp]
+            used = set()
+            while True:
+                best = None
+                for t, rem in enumerate(remaining):
+                    if t in used:
+                        continue
+                    free = sum(rem)
+                    for tests, usage, dists in options[exp]:
+                        if tests >= need and all(u <= r for u, r in zip(usage, rem)):
+                            key = (sum(usage), free - sum(usage))
+                            if best is None or key < best[0]:
+                                best = (key, t, tests, usage, dists)
+                            break
+                if best is None:
+                    # Split: give the emptiest unused tray the largest set of sets it holds
+                    for t in sorted(set(range(num_trays)) - used, key=lambda t: -sum(remaining[t])):
+                        fitting = [o for o in options[exp] if all(u <= r for u, r in zip(o[1], remaining[t]))]
+                        if fitting:
+                            tests, usage, dists = max(fitting, key=lambda o: (o[0], -sum(o[1])))
+                            best = (None, t, tests, usage, dists)
+                            break
+                if best is None:
+                    return None
+                _, t, tests, usage, dists = best
+                remaining[t] = [r - u for r, u in zip(remaining[t], usage)]
+                used.add(t)
+                placements.append((t, exp, dists))
+                need -= tests
+                if need <= 0:
+                    break
+        return placements
+
+    def _fill_trays(self, trays, selected_experiments, daily_counts, ledger):
+        """Spend leftover slots on extra sets for the experiments with the fewest fleet days"""
+        for config in trays:
+            while True:
+                free = config["available_locations"]
+                for exp in sorted(selected_experiments, key=lambda e: ledger.days.get(e, 0)):
+                    if len(self.catalog.experiment_reagents[exp]) > len(free):
+                        continue
+                    locations, _ = self._find_best_locations_for_experiment(exp, free, daily_counts[exp])
+                    if locations:
+                        self._place_reagent_set(config, exp, locations, ledger)
+                        config["available_locations"] = [loc for loc in free if loc not in locations]
+                        break
+                else:
+                    break
+
+    def _optimize(self, selected_experiments, daily_counts, method, node_limit):
+        if method == "greedy":
+            return self._optimize_greedy(selected_experiments, daily_counts)
+        elif method == "exact":
+            return self._optimize_exact(selected_experiments, daily_counts, node_limit)
+        elif method == "dp":
+            return self._optimize_dp(selected_experiments, daily_counts)
+        else:
+            raise ValueError(f"Unsupported optimization method: {method}")
+
+    def _new_configuration(self, daily_counts):
+        """Create an empty configuration"""
+        return {
             "tray_locations": [None] * self.MAX_LOCATIONS,
             "results": {},
             "daily_counts": daily_counts,
             "available_locations": list(range(self.MAX_LOCATIONS))
         }
 
+    def _prioritize_experiments(self, selected_experiments, daily_counts):
+        """Order experiments by placement priority"""
         # Calculate priority scores
         experiment_metrics = []
         for exp in selected_experiments:
-            max_vol = max(r["vol"] for r in self.experiment_data[exp]["reagents"])
+            max_vol = self.catalog.max_volume(exp)
             daily_count = daily_counts[exp]
             
             # New priority scoring that better handles high-volume and high-frequency tests
@@ -165,11 +1839,20 @@ class ReagentOptimizer:
                 reverse=True
             )
         ]
-        
-   
+        return sorted_experiments
+
+    def _optimize_greedy(self, selected_experiments, daily_counts, order=None):
+        """Two-phase greedy placement, in priority order unless an order is given"""
+        config = self._new_configuration(daily_counts)
+        sorted_experiments = order or self._prioritize_experiments(selected_experiments, daily_counts)
+        ledger = _TestLedger(self.catalog, daily_counts)
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.lap("setup")
+
         # Phase 1: Initial placement prioritizing high-volume and high-frequency tests
         for exp in sorted_experiments:
-            num_reagents = len(self.experiment_data[exp]["reagents"])
+            num_reagents = len(self.catalog.experiment_reagents[exp])
             if num_reagents > len(config["available_locations"]):
                 raise ValueError(f"Not enough locations available for experiment {exp}")
 
@@ -178,35 +1861,35 @@ class ReagentOptimizer:
             )
 
             if best_locations:
-                self._place_reagent_set(config, exp, best_locations)
+                self._place_reagent_set(config, exp, best_locations, ledger)
                 config["available_locations"] = [
                     loc for loc in config["available_locations"] 
                     if loc not in best_locations
                 ]
 
+        if stats is not None:
+            stats.lap("phase1")
+
         # Phase 2: Fill remaining locations to maximize days of operation
         while config["available_locations"]:
+            if stats is not None:
+                stats.count("phase2_iterations")
             best_addition = None
             best_improvement = 0
-            current_min_days = float('inf')
-
-            # Calculate current minimum days of operation
-            for exp in sorted_experiments:
-                if exp in config["results"]:
-                    current_tests = self._calculate_experiment_tests(config["tray_locations"], exp)
-                    days = current_tests / daily_counts[exp]
-                    current_min_days = min(current_min_days, days)
+            current_min_days = ledger.min_days()
 
             # Try to improve the limiting experiments
             for exp in sorted_experiments:
-                num_reagents = len(self.experiment_data[exp]["reagents"])
+                num_reagents = len(self.catalog.experiment_reagents[exp])
                 if num_reagents > len(config["available_locations"]):
                     continue
 
-                current_tests = self._calculate_experiment_tests(config["tray_locations"], exp)
+                current_tests = ledger.tests(exp)
                 current_days = current_tests / daily_counts[exp]
 
                 if current_days > current_min_days * 1.2:  # Skip if already 20% better
+                    if stats is not None:
+                        stats.count("candidates_pruned")
                     continue
 
                 best_locations, additional_tests = self._find_best_locations_for_experiment(
@@ -224,7 +1907,7 @@ class ReagentOptimizer:
 
             if best_addition:
                 exp, locations = best_addition
-                self._place_reagent_set(config, exp, locations)
+                self._place_reagent_set(config, exp, locations, ledger)
                 config["available_locations"] = [
                     loc for loc in config["available_locations"] 
                     if loc not in locations
@@ -232,56 +1915,390 @@ class ReagentOptimizer:
             else:
                 break
 
+        if stats is not None:
+            stats.lap("phase2")
+
         # Calculate final results
         self._calculate_final_results(config)
         return config
 
+    def _capacity_classes(self, locations=None):
+        """Group tray locations by capacity, largest capacity first"""
+        if locations is None:
+            locations = range(self.MAX_LOCATIONS)
+        classes = defaultdict(list)
+        for loc in locations:
+            classes[self.get_location_capacity(loc)].append(loc)
+        return sorted(classes.items(), reverse=True)
+
+    def _slot_distributions(self, num_slots, class_counts):
+        """Yield every way to spread num_slots over the capacity classes"""
+        if len(class_counts) == 1:
+            if num_slots <= class_counts[0]:
+                yield (num_slots,)
+            return
+        for n in range(min(num_slots, class_counts[0]), -1, -1):
+            for rest in self._slot_distributions(num_slots - n, class_counts[1:]):
+                yield (n,) + rest
+
+    def _experiment_options(self, exp_num, class_counts, deadline=None, stopped=None):
+        """Enumerate the non-dominated ways to give an experiment one or more reagent sets
+
+        Returns a tuple of (tests, usage, distributions) where usage counts the
+        slots taken from each capacity class and distributions gives, for each
+        reagent (largest volume first), the number of its slots in each class.
+        Results are kept per (experiment, class counts) until rebuild_tables().
+        Returns None if time.perf_counter() passes deadline, or stopped()
+        turns true, before the enumeration is complete.
+        """
+        key = (exp_num, tuple(class_counts))
+        options = self._options_cache.get(key)
+        if options is None:
+            options = self._enumerate_options(exp_num, class_counts, deadline, stopped)
+            if options is not None:
+                self._options_cache[key] = options
+        return options
+
+    def _enumerate_options(self, exp_num, class_counts, deadline=None, stopped=None):
+        rows = self._reagent_rows[exp_num]
+        num_classes = len(class_counts)
+        grid = _UsageGrid(class_counts)
+        overflow = grid.overflow
+
+        options = {}
+        for num_sets in range(1, sum(class_counts) // len(rows) + 1):
+            dists = [(dist, grid.offset(dist)) for dist in self._slot_distributions(num_sets, class_counts)]
+            # Every state in a step holds the same number of slots, so no state can
+            # undercut another in every class; keeping the most tests per usage is
+            # all the pruning a step allows. Dominated options only appear across
+            # set counts and are dropped at the end.
+            frontier = {grid.empty: float('inf')}
+            steps = []
+            for row in rows:
+                class_tests = self._tests_per_fill[row:row + num_classes]
+                expanded = {}
+                parents = {}
+                for dist, offset in dists:
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return None
+                    if stopped is not None and stopped():
+                        return None
+                    tests = sum(n * t for n, t in zip(dist, class_tests))
+                    for code, set_tests in frontier.items():
+                        new_code = code + offset
+                        if new_code & overflow:
+                            continue
+                        new_tests = set_tests if set_tests < tests else tests
+                        if new_tests > expanded.get(new_code, -1):
+                            expanded[new_code] = new_tests
+                            parents[new_code] = (code, dist)
+                frontier = expanded
+                steps.append(parents)
+
+            for final_code, tests in frontier.items():
+                code, chosen = final_code, []
+                for parents in reversed(steps):
+                    code, dist = parents[code]
+                    chosen.append(dist)
+                options[final_code] = (tests, tuple(reversed(chosen)))
+
+        # Drop options that use at least as many slots of every class for no more tests
+        undercut = grid.undercut({code: tests for code, (tests, _) in options.items()})
+        pareto = [
+            (tests, grid.unpack(code), dists)
+            for code, (tests, dists) in options.items() if code not in undercut
+        ]
+        pareto.sort(key=lambda option: (-option[0], sum(option[1])))
+        return tuple(pareto)
+
+    def _optimize_anytime(self, selected_experiments, daily_counts, node_limit, deadline_ms):
+        """Greedy configuration improved by branch-and-bound until the deadline"""
+        start = time.perf_counter()
+        deadline = start + deadline_ms / 1000
+        trajectory = []
+
+        def record(days, source):
+            trajectory.append({
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                "days": days,
+                "source": source,
+            })
+
+        greedy = self._optimize_greedy(selected_experiments, daily_counts)
+        record(greedy["overall_days_of_operation"], "greedy")
+
+        config = self._optimize_exact(
+            selected_experiments, daily_counts, node_limit,
+            deadline=deadline, incumbent=greedy,
+            on_improve=lambda days: record(days, "branch_and_bound"),
+        )
+        config["proven_optimal"] = config["optimality_gap"] == 0
+        config["trajectory"] = trajectory
+        return config
+
+    def _optimize_exact(self, selected_experiments, daily_counts, node_limit=None, deadline=None,
+                        incumbent=None, on_improve=None):
+        """Branch-and-bound search for the configuration with the most days of operation
+
+        The search stops early after node_limit nodes or once time.perf_counter()
+        passes deadline. An incumbent configuration is kept unless the search
+        beats it; on_improve is called with the days of every better placement.
+        """
+        classes = self._capacity_classes()
+        class_counts = tuple(len(locs) for _, locs in classes)
+
+        total_reagents = sum(len(self.catalog.experiment_reagents[exp]) for exp in selected_experiments)
+        if total_reagents > self.MAX_LOCATIONS:
+            raise ValueError("Not enough locations available for the selected experiments")
+
+        stopped = _active_stop.get()
+        order = self._prioritize_experiments(selected_experiments, daily_counts)
+        options = []
+        for exp in order:
+            exp_options = self._experiment_options(exp, class_counts, deadline, stopped)
+            if exp_options is None or (deadline is not None and time.perf_counter() > deadline):
+                # Out of time before the search could start: nothing is proven
+                config = incumbent or self._optimize_greedy(selected_experiments, daily_counts)
+                config["optimality_gap"] = None
+                return config
+            exp_options = [(tests / daily_counts[exp], usage, dists) for tests, usage, dists in exp_options]
+            exp_options.sort(key=lambda o: (-o[0], sum(o[1])))
+            options.append(exp_options)
+
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("options_enumerated", sum(len(o) for o in options))
+            stats.lap("options")
+
+        # Slots that must stay free so every later experiment can still get one set
+        min_slots = [len(self.catalog.experiment_reagents[exp]) for exp in order]
+        needed = [sum(min_slots[i:]) for i in range(len(order) + 1)]
+
+        bound_cache = {}
+
+        def best_alone(i, remaining, free_slots):
+            """Best days experiment i can reach on its own from the remaining slots"""
+            key = (i, remaining, free_slots)
+            if key not in bound_cache:
+                bound_cache[key] = next(
+                    (days for days, usage, _ in options[i]
+                     if sum(usage) <= free_slots and all(u <= r for u, r in zip(usage, remaining))),
+                    0
+                )
+            return bound_cache[key]
+
+        def upper_bound(i, remaining, current_min):
+            """Max-min days bound: no experiment can beat its best option on the free slots"""
+            free_slots = sum(remaining) - needed[i]
+            bound = current_min
+            for j in range(i, len(order)):
+                bound = min(bound, best_alone(j, remaining, free_slots + min_slots[j]))
+            return bound
+
+        root_bound = upper_bound(0, class_counts, float('inf'))
+        best = {"days": incumbent["overall_days_of_operation"] if incumbent else 0, "choice": None}
+        nodes = 0
+        pruned = 0
+        exhausted = False
+
+        def search(i, remaining, current_min, choice):
+            nonlocal nodes, pruned, exhausted
+            if i == len(order):
+                if current_min > best["days"]:
+                    best["days"] = current_min
+                    best["choice"] = list(choice)
+                    if on_improve is not None:
+                        on_improve(current_min)
+                return
+            if node_limit is not None and nodes >= node_limit:
+                exhausted = True
+                return
+            if (deadline is not None and time.perf_counter() > deadline) or (stopped is not None and stopped()):
+                exhausted = True
+                return
+            nodes += 1
+            free_slots = sum(remaining) - needed[i + 1]
+            for days, usage, dists in options[i]:
+                if min(current_min, days) <= best["days"]:
+                    break
+                # A node can try thousands of options on a large tray
+                if (deadline is not None and time.perf_counter() > deadline) or (stopped is not None and stopped()):
+                    exhausted = True
+                    return
+                if sum(usage) > free_slots or any(u > r for u, r in zip(usage, remaining)):
+                    continue
+                new_remaining = tuple(r - u for r, u in zip(remaining, usage))
+                new_min = min(current_min, days)
+                if upper_bound(i + 1, new_remaining, new_min) <= best["days"]:
+                    pruned += 1
+                    continue
+                choice.append(dists)
+                search(i + 1, new_remaining, new_min, choice)
+                choice.pop()
+
+        search(0, class_counts, float('inf'), [])
+        if stats is not None:
+            stats.count("nodes", nodes)
+            stats.count("candidates_pruned", pruned)
+            stats.lap("search")
+
+        if best["choice"] is None and incumbent is not None:
+            config = incumbent
+        elif best["choice"] is None:
+            # Search was cut off before reaching a complete placement
+            config = self._optimize_greedy(selected_experiments, daily_counts)
+        else:
+            config = self._new_configuration(daily_counts)
+            pools = [list(locs) for _, locs in classes]
+            for exp, dists in zip(order, best["choice"]):
+                self._place_distributions(config, exp, dists, pools)
+            self._calculate_final_results(config)
+
+        config["optimality_gap"] = (
+            max(root_bound - config["overall_days_of_operation"], 0) if exhausted else 0
+        )
+        if stats is not None:
+            stats.lap("placement")
+        return config
+
+    def _optimize_dp(self, selected_experiments, daily_counts):
+        """Binary search on target days over a capacity-class dynamic program"""
+        classes = self._capacity_classes()
+        class_counts = tuple(len(locs) for _, locs in classes)
+
+        total_reagents = sum(len(self.catalog.experiment_reagents[exp]) for exp in selected_experiments)
+        if total_reagents > self.MAX_LOCATIONS:
+            raise ValueError("Not enough locations available for the selected experiments")
+
+        order = self._prioritize_experiments(selected_experiments, daily_counts)
+        options = [
+            [(tests / daily_counts[exp], usage, dists)
+             for tests, usage, dists in self._experiment_options(exp, class_counts)]
+            for exp in order
+        ]
+
+        stats = _active_stats.get()
+        if stats is not None:
+            stats.count("options_enumerated", sum(len(o) for o in options))
+            stats.lap("options")
+
+        grid = _UsageGrid(class_counts)
+        offsets = [[grid.offset(o[1]) for o in exp_options] for exp_options in options]
+
+        def solve(target):
+            """Return one option per experiment reaching target days, or None"""
+            # states maps packed slots used per class to the options chosen so far
+            states = {grid.empty: ()}
+            if stats is not None:
+                stats.count("dp_solves")
+            for exp_options, exp_offsets in zip(options, offsets):
+                usable = {
+                    offset: o for o, offset in zip(exp_options, exp_offsets) if o[0] >= target
+                }
+                usages = [code - grid.empty for code in grid.minimal([grid.empty + offset for offset in usable])]
+                next_states = {}
+                for used, chosen in states.items():
+                    for usage in usages:
+                        new_used = used + usage
+                        if new_used in next_states or new_used & grid.overflow:
+                            continue
+                        next_states[new_used] = chosen + (usable[usage],)
+                if not next_states:
+                    return None
+                states = {used: next_states[used] for used in grid.minimal(list(next_states))}
+                if stats is not None:
+                    stats.count("states_expanded", len(next_states))
+                    stats.count("candidates_pruned", len(next_states) - len(states))
+            return next(iter(states.values()))
+
+        # The optimum is always the days value of some experiment option
+        targets = sorted({o[0] for exp_options in options for o in exp_options})
+        best = solve(targets[0])
+        low, high = 1, len(targets) - 1
+        while low <= high:
+            mid = (low + high) // 2
+            chosen = solve(targets[mid])
+            if chosen is None:
+                high = mid - 1
+            else:
+                best = chosen
+                low = mid + 1
+
+        if stats is not None:
+            stats.lap("search")
+
+        # Map slot counts back to concrete locations only once the optimum is known
+        config = self._new_configuration(daily_counts)
+        pools = [list(locs) for _, locs in classes]
+        for exp, (_, _, dists) in zip(order, best):
+            self._place_distributions(config, exp, dists, pools)
+        self._calculate_final_results(config)
+        config["optimality_gap"] = 0
+        if stats is not None:
+            stats.lap("placement")
+        return config
+
+    def _place_distributions(self, config, exp_num, distributions, pools, ledger=None):
+        """Turn per-reagent class counts into concrete reagent sets and place them"""
+        slot_classes = [
+            [c for c, n in enumerate(dist) for _ in range(n)]
+            for dist in distributions
+        ]
+        for set_classes in zip(*slot_classes):
+            locations = [pools[c].pop(0) for c in set_classes]
+            self._place_reagent_set(config, exp_num, locations, ledger)
+            config["available_locations"] = [
+                loc for loc in config["available_locations"]
+                if loc not in locations
+            ]
+
     def _calculate_experiment_tests(self, tray_locations, exp_num):
         """Calculate total tests possible for an experiment"""
         reagent_tests = defaultdict(int)
-        exp_data = self.experiment_data[exp_num]
-        
+
         for loc in tray_locations:
             if loc and loc["experiment"] == exp_num:
                 reagent_tests[loc["reagent_code"]] += loc["tests_possible"]
-        
-        required_reagents = {r["code"] for r in exp_data["reagents"]}
+
+        required_reagents = self.catalog.experiment_codes(exp_num)
         if not all(code in reagent_tests for code in required_reagents):
             return 0
             
         return min(reagent_tests.values())
 
     
-    def _place_reagent_set(self, config, exp_num, locations):
-        """Place a set of reagents in the specified locations"""
-        exp_data = self.experiment_data[exp_num]
-        reagents = sorted(exp_data["reagents"], key=lambda r: r["vol"], reverse=True)
+    def _place_reagent_set(self, config, exp_num, locations, ledger=None):
+        """Place a set of reagents in the specified locations
+
+        When a _TestLedger is given, its running totals are updated as well.
+        """
+        reagents = [self.catalog.reagents[i] for i in self.catalog.experiment_reagents[exp_num]]
 
         set_tests = float('inf')
         placements = []
 
-        for loc, reagent in zip(locations, reagents):
-            capacity = self.get_location_capacity(loc)
-            tests = self.calculate_tests(reagent["vol"], capacity)
+        for loc, reagent, row in zip(locations, reagents, self._reagent_rows[exp_num]):
+            capacity = self._capacities[self._location_class[loc]]
+            tests = self._tests_for(row, loc)
             set_tests = min(set_tests, tests)
             
             config["tray_locations"][loc] = {
-                "reagent_code": reagent["code"],
+                "reagent_code": reagent.code,
                 "experiment": exp_num,
                 "tests_possible": tests,
-                "volume_per_test": reagent["vol"],
+                "volume_per_test": reagent.volume,
                 "capacity": capacity
             }
             placements.append({
                 "location": loc,
                 "tests": tests,
-                "reagent": reagent["code"]
+                "reagent": reagent.code
             })
 
         # Initialize or update experiment results
         if exp_num not in config["results"]:
             config["results"][exp_num] = {
-                "name": exp_data["name"],
+                "name": self.catalog.experiment_names[exp_num],
                 "total_tests": 0,
                 "daily_count": config["daily_counts"][exp_num],
                 "days_of_operation": 0,
@@ -293,6 +2310,9 @@ class ReagentOptimizer:
             "tests_per_set": set_tests
         })
 
+        if ledger is not None:
+            ledger.add_set(exp_num, [(reagent.index, p["tests"]) for reagent, p in zip(reagents, placements)])
+
     def _calculate_final_results(self, config):
         """Calculate final results and adjust for daily counts"""
         for exp_num in config["results"].keys():
@@ -310,39 +2330,42 @@ class ReagentOptimizer:
 
     def get_available_experiments(self):
         """Return list of available experiments"""
-        return [{"id": id_, "name": exp["name"]} 
-                for id_, exp in self.experiment_data.items()]
+        self._ensure_tables()
+        return [{"id": id_, "name": name}
+                for id_, name in self.catalog.experiment_names.items()]
 
     def get_reagent_info(self, reagent_code):
         """Get information about a specific reagent code"""
-        for exp_id, exp_data in self.experiment_data.items():
-            for reagent in exp_data["reagents"]:
-                if reagent["code"] == reagent_code:
-                    return {
-                        "experiment_id": exp_id,
-                        "experiment_name": exp_data["name"],
-                        "volume": reagent["vol"]
-                    }
-        return None
+        self._ensure_tables()
+        reagent = self.catalog.reagent(reagent_code)
+        if reagent is None:
+            return None
+        return {
+            "experiment_id": reagent.experiment_id,
+            "experiment_name": self.catalog.experiment_names[reagent.experiment_id],
+            "volume": reagent.volume
+        }
 
     def get_location_info(self, location):
         """Get information about a specific location"""
         return {
             "location_number": location + 1,
             "capacity": self.get_location_capacity(location),
-            "is_high_capacity": location < 4
+            "is_high_capacity": self.geometry.is_high_capacity(location)
         }
 
     def get_configuration_summary(self, config):
         """Get a detailed summary of the configuration"""
         if not config:
             return None
+        if isinstance(config, TrayConfiguration):
+            config = config.to_dict()
 
         summary = {
             "overall_days": config["overall_days_of_operation"],
             "total_locations_used": len([loc for loc in config["tray_locations"] if loc is not None]),
             "high_capacity_usage": len([loc for i, loc in enumerate(config["tray_locations"]) 
-                                      if loc is not None and i < 4]),
+                                      if loc is not None and self.geometry.is_high_capacity(i)]),
             "experiments": {},
             "locations": []
         }
@@ -371,7 +2394,7 @@ class ReagentOptimizer:
             location_info = {
                 "location": i + 1,
                 "capacity": self.get_location_capacity(i),
-                "is_high_capacity": i < 4
+                "is_high_capacity": self.geometry.is_high_capacity(i)
             }
             if loc:
                 location_info.update({
@@ -386,12 +2409,17 @@ class ReagentOptimizer:
 
     def validate_configuration(self, config):
         """Validate a configuration for correctness"""
+        self._ensure_tables()
+        if isinstance(config, TrayConfiguration):
+            config = config.to_dict()
         if not config or "tray_locations" not in config:
             return False
 
         # Check experiment completeness
         for exp_num in config.get("results", {}):
-            required_reagents = {r["code"] for r in self.experiment_data[exp_num]["reagents"]}
+            if exp_num not in self.catalog.experiment_reagents:
+                return False
+            required_reagents = self.catalog.experiment_codes(exp_num)
             found_reagents = set()
             
             for loc in config["tray_locations"]:
@@ -408,13 +2436,23 @@ class ReagentOptimizer:
                     return False
                 if "tests_possible" not in loc or "volume_per_test" not in loc:
                     return False
+                reagent = self.catalog.reagent(loc["reagent_code"], loc["experiment"])
+                if reagent is None:
+                    return False
+                row = reagent.index * len(self._capacities)
+                if loc["tests_possible"] != self._tests_for(row, i):
+                    return False
 
         return True
 
     def export_configuration(self, config, format='dict'):
-        """Export configuration in the specified format"""
+        """Export configuration as 'dict', 'json', or a 'binary', 'base45' or 'base32' layout code"""
         if not config:
             return None
+        if format in ('binary', 'base45', 'base32'):
+            return self.encode_layout(config, text=None if format == 'binary' else format)
+        if isinstance(config, TrayConfiguration):
+            config = config.to_dict()
 
         basic_info = {
             "timestamp": datetime.now().isoformat(),
@@ -443,9 +2481,286 @@ class ReagentOptimizer:
         else:
             raise ValueError(f"Unsupported export format: {format}")
 
+    def _layout_tag(self):
+        return zlib.crc32(self.catalog_version().encode()) & 0xFFFF
+
+    def encode_layout(self, config, text=None):
+        """Encode a tray layout as compact versioned bytes, or as "base45"/"base32" text
+
+        Only the layout and daily counts are kept; decode_layout() rebuilds
+        the full configuration. A 16-slot tray encodes to about 40 bytes.
+        """
+        self._ensure_tables()
+        if text not in (None, "base45", "base32"):
+            raise ValueError(f"Unsupported layout text encoding: {text}")
+        tray = config if isinstance(config, TrayConfiguration) else self.compact_configuration(config)
+        if len(tray.reagents) != self.MAX_LOCATIONS:
+            raise ValueError("Configuration does not match this tray geometry")
+        if len(self.catalog) >= 255 or self.MAX_LOCATIONS > 255:
+            raise ValueError("Catalog or tray too large for the layout code")
+
+        num_classes = len(self._capacities)
+        filled = [loc for loc, reagent in enumerate(tray.reagents) if reagent != tray.EMPTY]
+        flags = 0
+        if any(tray.tests[loc] != self._tests_for(tray.reagents[loc] * num_classes, loc) for loc in filled):
+            flags |= _LAYOUT_FLAG_EXPLICIT_TESTS
+        if any(tray.sets[loc] > 15 for loc in filled):
+            flags |= _LAYOUT_FLAG_WIDE_SETS
+
+        out = bytearray([LAYOUT_VERSION])
+        out += self._layout_tag().to_bytes(2, "big")
+        out += bytes([self.MAX_LOCATIONS, flags])
+        out += bytes(0 if reagent == tray.EMPTY else reagent + 1 for reagent in tray.reagents)
+        sets = [tray.sets[loc] for loc in filled]
+        if flags & _LAYOUT_FLAG_WIDE_SETS:
+            out += bytes(sets)
+        else:
+            sets.append(0)
+            out += bytes(sets[i] << 4 | sets[i + 1] for i in range(0, len(sets) - 1, 2))
+
+        experiments = list(tray.order)
+        _write_varint(out, len(experiments))
+        for exp in experiments:
+            daily_count = tray.daily_counts[exp]
+            if daily_count != int(daily_count) or daily_count <= 0:
+                raise ValueError(f"Daily count of experiment {exp} must be a positive integer to encode")
+            _write_varint(out, exp)
+            _write_varint(out, int(daily_count))
+        if flags & _LAYOUT_FLAG_EXPLICIT_TESTS:
+            for loc in filled:
+                _write_varint(out, tray.tests[loc])
+        out += zlib.crc32(out).to_bytes(4, "big")
+
+        if text == "base45":
+            return _b45encode(bytes(out))
+        if text == "base32":
+            return base64.b32encode(bytes(out)).decode().rstrip("=")
+        return bytes(out)
+
+    def decode_layout(self, code, text="base45"):
+        """Rebuild a configuration dict from encode_layout() bytes or text
+
+        Strings are decoded as text (base45 unless told otherwise); bytes are
+        taken as the binary form.
+        """
+        self._ensure_tables()
+        if isinstance(code, str):
+            if text == "base45":
+                data = _b45decode(code.strip())
+            elif text == "base32":
+                code = code.strip().upper()
+                try:
+                    data = base64.b32decode(code + "=" * (-len(code) % 8))
+                except ValueError:
+                    raise ValueError("Invalid base32 layout code")
+            else:
+                raise ValueError(f"Unsupported layout text encoding: {text}")
+        else:
+            data = bytes(code)
+
+        if len(data) < 9:
+            raise ValueError("Truncated layout code")
+        if zlib.crc32(data[:-4]) != int.from_bytes(data[-4:], "big"):
+            raise ValueError("Layout code checksum mismatch")
+        data = data[:-4]
+        if data[0] != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported layout code version: {data[0]}")
+        if int.from_bytes(data[1:3], "big") != self._layout_tag():
+            raise ValueError("Layout code was made for a different reagent catalog or tray")
+        num_slots, flags = data[3], data[4]
+        if num_slots != self.MAX_LOCATIONS:
+            raise ValueError("Layout code was made for a different reagent catalog or tray")
+
+        pos = 5
+        slots = data[pos:pos + num_slots]
+        pos += num_slots
+        filled = [loc for loc, value in enumerate(slots) if value]
+        if any(slots[loc] > len(self.catalog) for loc in filled):
+            raise ValueError("Layout code refers to an unknown reagent")
+        if flags & _LAYOUT_FLAG_WIDE_SETS:
+            sets = list(data[pos:pos + len(filled)])
+            pos += len(filled)
+        else:
+            packed = data[pos:pos + (len(filled) + 1) // 2]
+            pos += (len(filled) + 1) // 2
+            sets = [nibble for byte in packed for nibble in (byte >> 4, byte & 0x0F)][:len(filled)]
+        if len(sets) < len(filled):
+            raise ValueError("Truncated layout code")
+
+        count, pos = _read_varint(data, pos)
+        daily_counts = {}
+        for _ in range(count):
+            exp, pos = _read_varint(data, pos)
+            daily_counts[exp], pos = _read_varint(data, pos)
+            if exp not in self.catalog.experiment_reagents:
+                raise ValueError(f"Layout code refers to an unknown experiment: {exp}")
+            if daily_counts[exp] <= 0:
+                raise ValueError(f"Layout code has an invalid daily count for experiment {exp}")
+
+        num_classes = len(self._capacities)
+        tray = TrayConfiguration(self.catalog, self._slot_capacities, daily_counts)
+        tray.order = list(daily_counts)
+        for loc, set_number in zip(filled, sets):
+            index = slots[loc] - 1
+            if self.catalog.reagents[index].experiment_id not in daily_counts:
+                raise ValueError(f"Layout code has no daily count for the reagent at location {loc + 1}")
+            if flags & _LAYOUT_FLAG_EXPLICIT_TESTS:
+                tests, pos = _read_varint(data, pos)
+            else:
+                tests = self._tests_for(index * num_classes, loc)
+            tray.place(loc, index, tests, set_number)
+        if pos != len(data):
+            raise ValueError("Unexpected data at the end of the layout code")
+        return tray.to_dict()
+
+    def __getstate__(self):
+        # Caches hold open connections and locks, so they stay in the parent process
+        state = self.__dict__.copy()
+        state["cache"] = None
+        # Hooks are often closures or bound methods; workers only attach config["stats"]
+        state["stats_hook"] = None
+        state["_portfolio"] = None
+        state["_portfolio_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._portfolio_lock = threading.Lock()
+
+    def close(self):
+        """Shut down the optimize_portfolio() worker processes, if any were started"""
+        with self._portfolio_lock:
+            if self._portfolio is not None:
+                self._portfolio[0].shutdown(wait=True, cancel_futures=True)
+                self._portfolio = None
+
     def __str__(self):
         return f"ReagentOptimizer(experiments={len(self.experiment_data)}, max_locations={self.MAX_LOCATIONS})"
 
     def __repr__(self):
         return f"ReagentOptimizer(experiments={len(self.experiment_data)}, max_locations={self.MAX_LOCATIONS})"
 
+
+
+def _read_orders(path):
+    """Stream orders from a JSONL or CSV file ("-" reads JSONL from stdin)
+
+    JSONL lines hold an order object. CSV files need a daily_counts column
+    of "exp:count" pairs separated by ";" and may add order_id and an
+    experiments column ("1;10;16"). Every order gets its line number; lines
+    that cannot be parsed become orders carrying a parse error.
+    """
+    import csv
+
+    if path == "-":
+        stream = sys.stdin
+    else:
+        stream = open(path, newline="")
+    try:
+        if path.lower().endswith(".csv"):
+            for line, row in enumerate(csv.DictReader(stream), start=2):
+                try:
+                    daily_counts = dict(
+                        pair.split(":") for pair in row["daily_counts"].split(";") if pair.strip()
+                    )
+                    experiments = [e for e in (row.get("experiments") or "").split(";") if e.strip()]
+                    order = {"experiments": experiments or list(daily_counts), "daily_counts": daily_counts}
+                except (KeyError, ValueError, AttributeError) as e:
+                    order = {"parse_error": f"Invalid CSV row: {e!r}"}
+                order["line"] = line
+                if row.get("order_id"):
+                    order["order_id"] = row["order_id"]
+                yield order
+        else:
+            for line, text in enumerate(stream, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    order = json.loads(text)
+                    if not isinstance(order, dict):
+                        raise ValueError("not an object")
+                except ValueError as e:
+                    order = {"parse_error": f"Invalid JSON: {e}"}
+                order["line"] = line
+                yield order
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _layout_string(config):
+    return ";".join(slot["reagent_code"] if slot else "" for slot in config["tray_locations"])
+
+
+def main(argv=None):
+    """Command line entry point: python -m reagent_optimizer plan orders.jsonl"""
+    import argparse
+    import csv
+
+    parser = argparse.ArgumentParser(prog="python -m reagent_optimizer",
+                                     description="Reagent tray optimization tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan = commands.add_parser("plan", help="optimize every order in a JSONL or CSV file")
+    plan.add_argument("orders", help="orders file (.jsonl or .csv), or - for JSONL on stdin")
+    plan.add_argument("-o", "--out", default="-", help="output file, default stdout")
+    plan.add_argument("--format", choices=["ndjson", "csv"],
+                      help="output format, default from the output file extension (ndjson)")
+    plan.add_argument("--method", default="greedy", choices=["greedy", "exact", "dp"])
+    plan.add_argument("--deadline-ms", type=float, help="time budget per order")
+    plan.add_argument("--workers", type=int, default=1, help="worker processes")
+    plan.add_argument("--chunksize", type=int, default=16, help="orders per worker task")
+    plan.add_argument("--progress", type=float, default=5.0,
+                      help="seconds between progress reports on stderr, 0 to disable")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("csv" if args.out.lower().endswith(".csv") else "ndjson")
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(["line", "order_id", "overall_days_of_operation", "error", "layout"])
+
+    optimizer = ReagentOptimizer()
+    start = last_report = time.perf_counter()
+    processed = failed = 0
+    try:
+        results = optimizer.optimize_many(
+            _read_orders(args.orders), workers=args.workers, method=args.method,
+            chunksize=args.chunksize, deadline_ms=args.deadline_ms
+        )
+        for result in results:
+            order, config = result["order"], result["config"]
+            error = order.get("parse_error") or result["error"]
+            days = config["overall_days_of_operation"] if config and not error else None
+            processed += 1
+            failed += error is not None
+
+            if writer is not None:
+                writer.writerow([order.get("line"), order.get("order_id", ""),
+                                 "" if days is None else days, error or "",
+                                 _layout_string(config) if days is not None else ""])
+            else:
+                record = {"line": order.get("line"), "order_id": order.get("order_id"),
+                          "overall_days_of_operation": days, "error": error,
+                          "configuration": config if days is not None else None}
+                out.write(_config_to_json(record) + "\n")
+
+            now = time.perf_counter()
+            if args.progress and now - last_report >= args.progress:
+                last_report = now
+                print(f"{processed} orders, {processed / (now - start):.0f} orders/s, "
+                      f"{failed} failed", file=sys.stderr, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"done: {processed} orders in {elapsed:.1f} s "
+          f"({processed / elapsed if elapsed else 0:.0f} orders/s), {failed} failed", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    # Run from the importable module so pool workers can unpickle its classes
+    import reagent_optimizer
+    sys.exit(reagent_optimizer.main())
@@ -0,0 +1,285 @@
+"""Local HTTP/JSON service around ReagentOptimizer
+
+Needs nothing beyond the standard library, so it can be load-tested on a
+laptop:
+
+    python service.py --port 8080 --workers 4 --max-pending 64
+
+Endpoints:
+    POST /optimize  {"experiments": [1, 16], "daily_counts": {"1": 2, "16": 1},
+                     "method": "greedy", "deadline_ms": null}
+    POST /summary   {"config": <configuration from /optimize>}
+    POST /export    {"config": <configuration>, "format": "dict" | "json" | "base45" | "base32" | "binary"}
+                    (binary answers application/octet-stream, the others JSON)
+    GET  /metrics   Prometheus text format
+    GET  /health
+
+Optimizations run in a bounded process pool. Identical orders arriving while
+one is being solved share its result, and once max_pending distinct orders
+are queued or running, new ones get 429 with a Retry-After header.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reagent_optimizer import (
+    ReagentOptimizer,
+    init_worker,
+    normalize_order,
+    restore_experiment_keys,
+    solve_orders,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class QueueFull(Exception):
+    """Raised when the service already holds max_pending optimizations"""
+
+
+class ServiceMetrics:
+    """Thread-safe request counters and latency histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.responses = Counter()
+        self.latency = {}
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, endpoint, status, seconds):
+        with self._lock:
+            self.responses[(endpoint, status)] += 1
+            buckets, total, count = self.latency.get(endpoint, ([0] * len(LATENCY_BUCKETS), 0.0, 0))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.latency[endpoint] = (buckets, total + seconds, count + 1)
+
+    def render(self, gauges):
+        """Prometheus text exposition of every metric"""
+        with self._lock:
+            lines = ["# TYPE tray_requests_total counter"]
+            for (endpoint, status), n in sorted(self.responses.items()):
+                lines.append(f'tray_requests_total{{endpoint="{endpoint}",status="{status}"}} {n}')
+            for name in ("optimizations", "coalesced", "rejected", "timeouts"):
+                lines.append(f"# TYPE tray_{name}_total counter")
+                lines.append(f"tray_{name}_total {self.counters[name]}")
+            for name, value in gauges.items():
+                lines.append(f"# TYPE tray_{name} gauge")
+                lines.append(f"tray_{name} {value}")
+            lines.append("# TYPE tray_request_duration_seconds histogram")
+            for endpoint, (buckets, total, count) in sorted(self.latency.items()):
+                for bound, n in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'tray_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {n}')
+                lines.append(f'tray_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'tray_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total:.6f}')
+                lines.append(f'tray_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class OptimizationService:
+    """Bounded worker pool with coalescing of identical concurrent orders"""
+
+    def __init__(self, optimizer=None, workers=None, max_pending=64, request_timeout=30.0,
+                 processes=True):
+        self.optimizer = optimizer or ReagentOptimizer()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.metrics = ServiceMetrics()
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor = pool(
+            max_workers=self.workers, initializer=init_worker, initargs=(self.optimizer,)
+        )
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def optimize(self, order):
+        """Solve one order, sharing the work with identical orders already in flight"""
+        experiments, daily_counts = normalize_order(order)
+        method = order.get("method", "greedy")
+        deadline_ms = order.get("deadline_ms")
+        experiments = sorted(experiments)
+        key = json.dumps([experiments, [daily_counts.get(exp) for exp in experiments], method, deadline_ms])
+
+        submitted = False
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                self.metrics.inc("coalesced")
+            else:
+                if len(self._pending) >= self.max_pending:
+                    self.metrics.inc("rejected")
+                    raise QueueFull()
+                future = self._executor.submit(
+                    solve_orders, [(experiments, daily_counts)], method, deadline_ms
+                )
+                self._pending[key] = future
+                self.metrics.inc("optimizations")
+                submitted = True
+        # Outside the lock: a future that is already done runs the callback right
+        # here, and _finished takes the lock itself
+        if submitted:
+            future.add_done_callback(lambda done, key=key: self._finished(key, done))
+
+        config, error = future.result(timeout=self.request_timeout)[0]
+        if error is not None:
+            raise ValueError(error)
+        return config
+
+    def _finished(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def summary(self, config):
+        return self.optimizer.get_configuration_summary(restore_experiment_keys(config))
+
+    def export(self, config, export_format="dict"):
+        return self.optimizer.export_configuration(restore_experiment_keys(config), format=export_format)
+
+    def gauges(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "max_pending": self.max_pending, "workers": self.workers}
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    server_version = "TrayOptimizer/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        start = time.perf_counter()
+        if self.path == "/health":
+            status = self._send_json(200, {"status": "ok", **self.service.gauges()})
+        elif self.path == "/metrics":
+            body = self.service.metrics.render(self.service.gauges()).encode()
+            status = self._send(200, body, "text/plain; version=0.0.4")
+        else:
+            status = self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        self.service.metrics.observe(self.path if status != 404 else "other", status,
+                                     time.perf_counter() - start)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        routes = {"/optimize": self._optimize, "/summary": self._summary, "/export": self._export}
+        handler = routes.get(self.path)
+        if handler is None:
+            status = self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        else:
+            try:
+                status = handler(self._read_json())
+            except QueueFull:
+                status = self._send_json(429, {"error": "Too many pending optimizations"},
+                                         {"Retry-After": "1"})
+            except FutureTimeoutError:
+                self.service.metrics.inc("timeouts")
+                status = self._send_json(504, {"error": "Optimization timed out"})
+            except (ValueError, KeyError, TypeError) as e:
+                status = self._send_json(400, {"error": str(e)})
+            except Exception:
+                logger.exception("Request to %s failed", self.path)
+                status = self._send_json(500, {"error": "Internal error"})
+        self.service.metrics.observe(self.path if handler else "other", status,
+                                     time.perf_counter() - start)
+
+    def _optimize(self, body):
+        return self._send_json(200, self.service.optimize(body))
+
+    def _summary(self, body):
+        return self._send_json(200, self.service.summary(body["config"]))
+
+    def _export(self, body):
+        export_format = body.get("format", "dict")
+        exported = self.service.export(body["config"], export_format)
+        if export_format == "json":
+            return self._send(200, exported.encode(), "application/json")
+        if export_format == "binary":
+            return self._send(200, exported, "application/octet-stream")
+        return self._send_json(200, exported)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def _send_json(self, status, payload, headers=None):
+        return self._send(status, json.dumps(payload).encode(), "application/json", headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(host="127.0.0.1", port=8080, **service_options):
+    """Create a threaded HTTP server bound to a new OptimizationService"""
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = OptimizationService(**service_options)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, help="worker processes, default one per CPU")
+    parser.add_argument("--max-pending", type=int, default=64,
+                        help="distinct orders queued or running before returning 429")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for a result")
+    parser.add_argument("--threads", action="store_true", help="solve in threads instead of processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    server = make_server(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                         request_timeout=args.timeout, processes=not args.threads)
+    logger.info("Serving on http://%s:%d with %d workers", args.host, args.port, server.service.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
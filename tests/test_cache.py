@@ -0,0 +1,42 @@
+import sqlite3
+
+from reagent_optimizer import OptimizationCache, ReagentOptimizer
+
+
+def layout(config):
+    return [loc["reagent_code"] if loc else None for loc in config["tray_locations"]]
+
+
+def test_in_place_volume_edit_misses_the_cache():
+    cache = OptimizationCache()
+    optimizer = ReagentOptimizer(cache=cache)
+    first = optimizer.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+    optimizer.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+    assert cache.get_stats()["hits"] == 1
+
+    optimizer.experiment_data[1]["reagents"][0]["vol"] *= 4
+    second = optimizer.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+    assert cache.get_stats()["misses"] == 2
+    assert second["overall_days_of_operation"] != first["overall_days_of_operation"]
+    assert layout(second) != layout(first)
+
+
+def test_disk_store_drops_rows_of_old_catalog_versions(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    optimizer = ReagentOptimizer(cache=OptimizationCache(path=str(path)))
+    optimizer.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+    optimizer.optimize_tray_configuration([10, 28], {10: 3, 28: 2})
+    old_version = optimizer.catalog_version()
+
+    optimizer.experiment_data[1]["reagents"][0]["vol"] *= 4
+    optimizer.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+
+    with sqlite3.connect(path) as db:
+        versions = [row[0] for row in db.execute("SELECT version FROM configurations")]
+    assert versions == [optimizer.catalog_version()]
+    assert old_version not in versions
+
+    reopened = ReagentOptimizer(cache=OptimizationCache(path=str(path)))
+    reopened.experiment_data[1]["reagents"][0]["vol"] *= 4
+    reopened.optimize_tray_configuration([1, 16], {1: 2, 16: 1})
+    assert reopened.cache.get_stats()["hits"] == 1
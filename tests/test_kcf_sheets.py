@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+from kcf_sheets import LocalSheet, ShipmentSpool
+
+
+def make_row(serial, customer="Acme"):
+    return [serial, "2024-01-01 10:00:00", customer, "Unit 1", 1, "TRK1",
+            "Yes", "Yes", "Yes", "op", "KETOS Fluid Tray"]
+
+
+class LostAckSheet(LocalSheet):
+    """LocalSheet whose next lost_acks writes land but still raise, like a timed-out call"""
+
+    def __init__(self, lost_acks=1, **kwargs):
+        super().__init__(**kwargs)
+        self.lost_acks = lost_acks
+
+    def append_rows(self, rows):
+        super().append_rows(rows)
+        if self.lost_acks > 0:
+            self.lost_acks -= 1
+            raise TimeoutError("Simulated lost acknowledgement")
+
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "spool.db")
+
+
+def test_enqueue_then_flush_writes_rows(spool_path):
+    sheet = LocalSheet()
+    spool = ShipmentSpool(spool_path, lambda: sheet)
+    assert spool.enqueue(make_row("AAAA0001"))
+    assert spool.enqueue(make_row("AAAA0002"))
+    assert spool.stats()["pending"] == 2
+
+    assert spool.flush() == 2
+    assert [row[0] for row in sheet.get_all_values()] == ["AAAA0001", "AAAA0002"]
+    stats = spool.stats()
+    assert stats["pending"] == 0
+    assert stats["sent"] == 2
+    assert stats["flushes"] == 1
+    assert spool.flush() == 0
+
+
+def test_background_writer_drains_queue(spool_path):
+    sheet = LocalSheet(latency=0.01)
+    spool = ShipmentSpool(spool_path, lambda: sheet, batch_size=2).start()
+    try:
+        for i in range(5):
+            spool.enqueue(make_row(f"BBBB000{i}"))
+        deadline = time.monotonic() + 5
+        while spool.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        spool.stop(timeout=5)
+    assert spool.stats()["pending"] == 0
+    assert sorted(row[0] for row in sheet.get_all_values()) == [f"BBBB000{i}" for i in range(5)]
+
+
+def test_failed_flush_backs_off_and_retries(spool_path):
+    sheet = LocalSheet(failures=2)
+    spool = ShipmentSpool(spool_path, lambda: sheet, base_backoff=1.0)
+    spool.enqueue(make_row("CCCC0001"))
+
+    assert spool.flush() == 0
+    first_delay = spool.retry_at - time.monotonic()
+    assert spool.stats()["last_error"] == "Simulated Sheets outage"
+    assert 0.5 < first_delay <= 1.2
+
+    assert spool.flush() == 0
+    second_delay = spool.retry_at - time.monotonic()
+    assert 1.5 < second_delay <= 2.4
+
+    assert spool.flush() == 1
+    assert spool.retry_at == 0.0
+    assert spool.stats()["last_error"] is None
+    assert [row[0] for row in sheet.get_all_values()] == ["CCCC0001"]
+
+
+def test_retry_after_lost_ack_does_not_duplicate(spool_path):
+    sheet = LostAckSheet(lost_acks=1)
+    spool = ShipmentSpool(spool_path, lambda: sheet)
+    spool.enqueue(make_row("DDDD0001"))
+
+    assert spool.flush() == 0
+    assert len(sheet.get_all_values()) == 1
+    spool.enqueue(make_row("DDDD0002"))
+
+    assert spool.flush() == 2
+    assert [row[0] for row in sheet.get_all_values()] == ["DDDD0001", "DDDD0002"]
+
+
+def test_repeated_serial_is_ignored(spool_path):
+    sheet = LocalSheet()
+    spool = ShipmentSpool(spool_path, lambda: sheet)
+    assert spool.enqueue(make_row("EEEE0001"))
+    assert not spool.enqueue(make_row("EEEE0001", customer="Other"))
+    spool.drain()
+    assert not spool.enqueue(make_row("EEEE0001"))
+    assert spool.drain() == 0
+
+    rows = sheet.get_all_values()
+    assert len(rows) == 1
+    assert rows[0][2] == "Acme"
+
+
+def test_unavailable_sheet_keeps_rows_spooled(spool_path):
+    spool = ShipmentSpool(spool_path, lambda: None)
+    spool.enqueue(make_row("FFFF0001"))
+    assert spool.flush() == 0
+    assert spool.stats()["pending"] == 1
+    assert spool.stats()["last_error"] == "Google Sheets is not configured"
@@ -0,0 +1,113 @@
+import json
+import threading
+import urllib.request
+import zlib
+
+import pytest
+
+from reagent_optimizer import LAYOUT_VERSION, ReagentOptimizer
+
+# Version 1 layout of experiments 10, 28, 1 and 16 (daily counts 3, 2, 2, 1)
+# on the default 16-slot tray. The bytes are the wire format: changing them
+# means old labels no longer decode.
+GOLDEN_HEX = (
+    "01147a1000141516323334010221222324323334000000000000001110040a031c0201021001191ba693"
+)
+GOLDEN_BASE45 = "660IJFK00/T2QF6%P65C09E4-P4DL6000000000H00512/B1FO3X50212$73S2L"
+GOLDEN_CODES = [
+    "KR10E1", "KR10E2", "KR10E3", "KR28E2", "KR28E3", "KR28E1", "KR1E", "KR1S",
+    "KR16E1", "KR16E2", "KR16E3", "KR16E4", "KR28E2", "KR28E3", "KR28E1", None,
+]
+
+
+@pytest.fixture(scope="module")
+def optimizer():
+    return ReagentOptimizer()
+
+
+def reseal(body):
+    """Layout bytes with a valid checksum appended"""
+    return bytes(body) + zlib.crc32(bytes(body)).to_bytes(4, "big")
+
+
+def daily_counts_offset(data):
+    """Position of the daily counts section in an unflagged layout code"""
+    num_slots = data[3]
+    filled = sum(1 for value in data[5:5 + num_slots] if value)
+    return 5 + num_slots + (filled + 1) // 2
+
+
+def test_golden_vector_decodes(optimizer):
+    data = bytes.fromhex(GOLDEN_HEX)
+    assert data[0] == LAYOUT_VERSION == 1
+    config = optimizer.decode_layout(data)
+    assert [loc["reagent_code"] if loc else None for loc in config["tray_locations"]] == GOLDEN_CODES
+    assert config["daily_counts"] == {10: 3, 28: 2, 1: 2, 16: 1}
+    assert config["overall_days_of_operation"] == 45.0
+    assert optimizer.decode_layout(GOLDEN_BASE45) == config
+
+
+def test_golden_vector_round_trips(optimizer):
+    config = optimizer.decode_layout(bytes.fromhex(GOLDEN_HEX))
+    assert optimizer.encode_layout(config).hex() == GOLDEN_HEX
+    assert optimizer.encode_layout(config, "base45") == GOLDEN_BASE45
+    assert optimizer.decode_layout(optimizer.encode_layout(config, "base32"), text="base32") == config
+
+
+def test_round_trip_of_optimized_layout(optimizer):
+    config = optimizer.optimize_tray_configuration([1, 16, 19], {1: 2, 16: 1, 19: 4})
+    decoded = optimizer.decode_layout(optimizer.encode_layout(config, "base45"))
+    assert decoded["tray_locations"] == config["tray_locations"]
+    assert decoded["overall_days_of_operation"] == config["overall_days_of_operation"]
+
+
+def test_unknown_experiment_is_rejected(optimizer):
+    body = bytearray(bytes.fromhex(GOLDEN_HEX)[:-4])
+    pos = daily_counts_offset(body)
+    assert body[pos + 1] == 10
+    body[pos + 1] = 99
+    with pytest.raises(ValueError, match="unknown experiment"):
+        optimizer.decode_layout(reseal(body))
+
+
+def test_zero_daily_count_is_rejected(optimizer):
+    body = bytearray(bytes.fromhex(GOLDEN_HEX)[:-4])
+    pos = daily_counts_offset(body)
+    body[pos + 2] = 0
+    with pytest.raises(ValueError, match="daily count"):
+        optimizer.decode_layout(reseal(body))
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    bytes.fromhex(GOLDEN_HEX)[:-1],
+    bytes.fromhex(GOLDEN_HEX)[:-4] + b"\x00\x00\x00\x00",
+    reseal(bytes.fromhex(GOLDEN_HEX)[:-5]),
+    reseal(bytes.fromhex(GOLDEN_HEX)[:-4] + b"\x00"),
+    reseal(b"\x02" + bytes.fromhex(GOLDEN_HEX)[1:-4]),
+])
+def test_damaged_codes_raise_value_error(optimizer, data):
+    with pytest.raises(ValueError):
+        optimizer.decode_layout(data)
+
+
+def test_service_exports_binary_layout():
+    from service import make_server
+
+    server = make_server(port=0, workers=1, processes=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        config = server.service.optimizer.decode_layout(bytes.fromhex(GOLDEN_HEX))
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{server.server_address[1]}/export",
+            data=json.dumps({"config": config, "format": "binary"}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Type"] == "application/octet-stream"
+            assert response.read().hex() == GOLDEN_HEX
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.service.close()
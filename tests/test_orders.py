@@ -0,0 +1,35 @@
+import pytest
+
+from reagent_optimizer import ReagentOptimizer, normalize_order, solve_order
+
+
+def test_normalize_order_converts_ids():
+    order = {"experiments": ["1", 16], "daily_counts": {"1": "2", "16": 1}}
+    assert normalize_order(order) == ([1, 16], {1: 2, 16: 1})
+
+
+@pytest.mark.parametrize("order, message", [
+    ({"experiments": "12", "daily_counts": {"1": 1, "2": 1}}, "experiments must be a list"),
+    ({"experiments": 12, "daily_counts": {"12": 1}}, "experiments must be a list"),
+    ({"daily_counts": {"1": 1}}, "experiments must be a list"),
+    ({"experiments": [1], "daily_counts": [[1, 1]]}, "daily_counts must map"),
+    ({"experiments": [], "daily_counts": {}}, "no experiments selected"),
+    ({"experiments": [1.5], "daily_counts": {"1": 1}}, "not an integer"),
+    ({"experiments": [True], "daily_counts": {"1": 1}}, "not an integer"),
+    ({"experiments": ["x"], "daily_counts": {"1": 1}}, "Invalid order"),
+    ([1, 16], "expected an object"),
+])
+def test_normalize_order_rejects_malformed_orders(order, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_order(order)
+
+
+def test_solve_order_reports_errors():
+    optimizer = ReagentOptimizer()
+    config, error = solve_order(optimizer, [1, 16], {1: 2, 16: 1})
+    assert error is None
+    assert config["overall_days_of_operation"] > 0
+
+    config, error = solve_order(optimizer, [], {})
+    assert config is None
+    assert error == "No experiments selected"
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from service import OptimizationService
+
+
+@pytest.fixture
+def thread_service():
+    service = OptimizationService(workers=4, processes=False)
+    yield service
+    service.close()
+
+
+def run_with_timeout(target, timeout=10):
+    """Run target in a daemon thread; fail instead of hanging if it deadlocks"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = target()
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "service call did not return"
+    return outcome
+
+
+def test_fast_failing_orders_do_not_deadlock(thread_service):
+    def send_many():
+        errors = []
+        for _ in range(50):
+            try:
+                thread_service.optimize({"experiments": [99], "daily_counts": {"99": 1}})
+            except ValueError as e:
+                errors.append(str(e))
+        return errors
+
+    outcome = run_with_timeout(send_many)
+    assert outcome["result"] == ["Invalid experiment number: 99"] * 50
+    assert thread_service.gauges()["pending"] == 0
+
+
+def test_optimize_in_threads(thread_service):
+    order = {"experiments": [1, 16], "daily_counts": {"1": 2, "16": 1}}
+    outcome = run_with_timeout(lambda: [thread_service.optimize(order) for _ in range(5)])
+    configs = outcome["result"]
+    assert all(c["overall_days_of_operation"] == configs[0]["overall_days_of_operation"] for c in configs)
+    assert thread_service.gauges()["pending"] == 0
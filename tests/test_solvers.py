@@ -0,0 +1,110 @@
+import itertools
+
+import pytest
+
+from reagent_optimizer import ReagentOptimizer
+
+SMALL_ORDERS = [
+    ([1, 16], {1: 2, 16: 1}),
+    ([10, 28], {10: 3, 28: 2}),
+    ([17, 19], {17: 1, 19: 2}),
+    ([1, 15, 20], {1: 3, 15: 2, 20: 1}),
+    ([17, 31, 20], {17: 2, 31: 1, 20: 3}),
+]
+
+# Greedy layouts from before the exact and dp solvers were added; the greedy
+# path must keep producing them slot for slot
+GREEDY_BASELINE = [
+    ([10, 16, 28], {10: 5, 16: 3, 28: 8}, 25.625,
+     "KR28E2 KR28E3 KR10E1 KR10E2 KR28E1 KR10E3 KR16E1 KR16E2 KR16E3 KR16E4 "
+     "KR10E1 KR10E2 KR10E3 KR28E2 KR28E3 KR28E1"),
+    ([1, 16, 29], {1: 2, 16: 1, 29: 3}, 158.5,
+     "KR29E1 KR29E2 KR29E3 KR1E KR1S KR16E1 KR16E2 KR16E3 KR16E4 KR29E1 KR29E2 KR29E3 "
+     "KR16E1 KR16E2 KR16E3 KR16E4"),
+    ([10, 30, 4], {10: 1, 30: 8, 4: 1}, 68.75,
+     "KR30E1 KR30E2 KR30E3 KR10E1 KR10E2 KR10E3 KR4E KR4S KR30E1 KR30E2 KR30E3 "
+     "KR30E1 KR30E2 KR30E3 - -"),
+    ([4, 14, 3], {4: 1, 14: 5, 3: 5}, 161.8,
+     "KR3E KR14E KR14S KR4E KR3S KR4S KR3E KR3S KR14E KR14S KR3E KR3S KR3E KR3S KR14E KR14S"),
+    ([34, 4, 8, 15, 30], {34: 1, 4: 2, 8: 1, 15: 8, 30: 2}, 80.625,
+     "KR15E KR30E1 KR30E2 KR30E3 KR15S KR8E2 KR8E1 KR4E KR4S KR34E1 KR34E2 "
+     "KR15E KR15S KR15E KR15S -"),
+    ([12, 4, 19, 36, 21, 7], {12: 3, 4: 1, 19: 8, 36: 12, 21: 1, 7: 8}, 14.75,
+     "KR36E2 KR7E2 KR7E1 KR19E1 KR36E1 KR19E2 KR19E3 KR21E1 KR12E1 KR12E2 KR12E3 "
+     "KR4E KR4S KR36E2 KR36E1 -"),
+    ([10, 42, 31], {10: 1, 42: 12, 31: 1}, 69.16666666666667,
+     "KR42E1 KR42E2 KR10E1 KR10E2 KR10E3 KR31E1 KR31E2 KR42E1 KR42E2 KR42E1 KR42E2 "
+     "KR42E1 KR42E2 KR42E1 KR42E2 -"),
+    ([28, 21, 9, 4], {28: 5, 21: 12, 9: 8, 4: 5}, 32.8,
+     "KR21E1 KR28E2 KR28E3 KR9E1 KR28E1 KR9E2 KR4E KR4S KR9E1 KR9E2 KR21E1 "
+     "KR28E2 KR28E3 KR28E1 KR21E1 KR21E1"),
+]
+
+
+@pytest.fixture(scope="module")
+def optimizer():
+    return ReagentOptimizer()
+
+
+def brute_force_days(optimizer, experiments, daily_counts):
+    """Best days of operation over every placement of whole reagent sets"""
+    classes = optimizer._capacity_classes()
+    capacities = [cap for cap, _ in classes]
+    class_counts = [len(locs) for _, locs in classes]
+
+    per_experiment = []
+    for exp in experiments:
+        reagents = optimizer.experiment_data[exp]["reagents"]
+        options = []
+        for num_sets in range(1, optimizer.MAX_LOCATIONS // len(reagents) + 1):
+            dists = [
+                dist for dist in itertools.product(*(range(min(c, num_sets) + 1) for c in class_counts))
+                if sum(dist) == num_sets
+            ]
+            for choice in itertools.product(dists, repeat=len(reagents)):
+                usage = [sum(d[c] for d in choice) for c in range(len(class_counts))]
+                if any(u > c for u, c in zip(usage, class_counts)):
+                    continue
+                tests = min(
+                    sum(n * optimizer.calculate_tests(r["vol"], cap) for n, cap in zip(dist, capacities))
+                    for dist, r in zip(choice, reagents)
+                )
+                options.append((usage, tests / daily_counts[exp]))
+        per_experiment.append(options)
+
+    best = 0
+    for combo in itertools.product(*per_experiment):
+        usage = [sum(option[0][c] for option in combo) for c in range(len(class_counts))]
+        if all(u <= c for u, c in zip(usage, class_counts)):
+            best = max(best, min(option[1] for option in combo))
+    return best
+
+
+@pytest.mark.parametrize("experiments, daily_counts", SMALL_ORDERS)
+def test_exact_and_dp_reach_brute_force_optimum(optimizer, experiments, daily_counts):
+    best = brute_force_days(optimizer, experiments, daily_counts)
+    exact = optimizer.optimize_tray_configuration(experiments, daily_counts, method="exact")
+    dp = optimizer.optimize_tray_configuration(experiments, daily_counts, method="dp")
+    assert exact["overall_days_of_operation"] == pytest.approx(best)
+    assert exact["optimality_gap"] == 0
+    assert dp["overall_days_of_operation"] == pytest.approx(exact["overall_days_of_operation"])
+    greedy = optimizer.optimize_tray_configuration(experiments, daily_counts)
+    assert greedy["overall_days_of_operation"] <= best + 1e-9
+
+
+@pytest.mark.parametrize("experiments, daily_counts", SMALL_ORDERS[3:])
+def test_optimality_gap_bounds_truncated_search(optimizer, experiments, daily_counts):
+    best = brute_force_days(optimizer, experiments, daily_counts)
+    config = optimizer.optimize_tray_configuration(experiments, daily_counts, method="exact", node_limit=1)
+    days = config["overall_days_of_operation"]
+    assert config["optimality_gap"] >= 0
+    assert days <= best + 1e-9
+    assert days + config["optimality_gap"] >= best - 1e-9
+
+
+@pytest.mark.parametrize("experiments, daily_counts, days, layout", GREEDY_BASELINE)
+def test_greedy_matches_baseline(optimizer, experiments, daily_counts, days, layout):
+    config = optimizer.optimize_tray_configuration(experiments, daily_counts)
+    codes = [loc["reagent_code"] if loc else "-" for loc in config["tray_locations"]]
+    assert config["overall_days_of_operation"] == pytest.approx(days)
+    assert " ".join(codes) == layout
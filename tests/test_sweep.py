@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from reagent_optimizer import ReagentOptimizer
+
+
+@pytest.fixture(scope="module")
+def optimizer():
+    return ReagentOptimizer()
+
+
+def test_sweep_matches_point_solves(optimizer):
+    df = optimizer.sweep([1, 16, 28], {1: [1, 2, 3], 16: [1, 2], 28: 2})
+    assert len(df) == 6
+    for _, row in df.iterrows():
+        counts = {exp: int(row[f"daily_count_{exp}"]) for exp in (1, 16, 28)}
+        config = optimizer.optimize_tray_configuration([1, 16, 28], counts, method="dp")
+        assert row["overall_days_of_operation"] == pytest.approx(config["overall_days_of_operation"])
+
+
+@pytest.mark.parametrize("counts", [{1: 2.5, 16: 1}, {1: 0.5, 16: 1.5}])
+def test_sweep_with_fractional_counts(optimizer, counts):
+    df = optimizer.sweep([1, 16], [counts])
+    config = optimizer.optimize_tray_configuration([1, 16], counts, method="dp")
+    assert df["overall_days_of_operation"].iloc[0] == pytest.approx(config["overall_days_of_operation"])
+    assert df["daily_count_1"].iloc[0] == counts[1]
+
+
+def test_sweep_accepts_numpy_axes(optimizer):
+    df = optimizer.sweep([1, 16], {1: np.arange(1, 5), 16: np.int64(1)})
+    assert df["daily_count_1"].tolist() == [1, 2, 3, 4]
+    assert df["daily_count_16"].tolist() == [1, 1, 1, 1]
+    days = df["overall_days_of_operation"].tolist()
+    assert days == sorted(days, reverse=True)
+
+
+def test_sweep_rejects_non_positive_counts(optimizer):
+    with pytest.raises(ValueError, match="positive"):
+        optimizer.sweep([1, 16], {1: [0, 1], 16: [1]})